@@ -3,3 +3,4 @@ from .beamtimedb import BeamtimeDB
 from .use_apsbss import filldb_from_apsbss, update_pvs
 from .esafpdf import read_esaf_pdfs
 
+from .matcher import ProposalMatcher
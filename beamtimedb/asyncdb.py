@@ -0,0 +1,378 @@
+"""
+asyncio interface to beamtime databases, using SQLAlchemy's asyncio
+extension with the asyncpg (PostgreSQL) or aiosqlite (SQLite) drivers
+(install with `pip install beamtimedb[async]`):
+
+   import asyncio
+   from beamtimedb.asyncdb import AsyncBeamtimeDB
+
+   async def main():
+       async with AsyncBeamtimeDB() as db:
+           expts = await asyncio.gather(*[db.get_current_experiments(bl)
+                                          for bl in ('13-ID-E', '13-BM-C')])
+
+   asyncio.run(main())
+
+AsyncSimpleDB has get_rows(), get_row(), lookup(), iter_rows(), insert(),
+insert_many(), update(), delete_rows(), get_info() and set_info() as for
+SimpleDB, as coroutines (iter_rows() is an async generator), and builds
+and caches statements in the same way.
+
+Each call, or each `async with db.transaction():` block, uses its own
+pooled connection, so that many queries can be awaited concurrently
+from one thread.
+"""
+import contextvars
+from datetime import datetime
+from contextlib import asynccontextmanager
+from warnings import warn
+
+from sqlalchemy import MetaData
+
+from sqlalchemy.pool import QueuePool
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+except ImportError:
+    warn('need sqlalchemy[asyncio] for asyncio database access')
+
+from .simpledb import (SimpleDB, connect_url, server_name, pool_engine_args,
+                       isotime)
+from .beamtimedb import get_credentials
+
+# default asyncio drivers for each server
+ASYNC_DIALECTS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite',
+                  'mysql': 'aiomysql'}
+
+
+class AsyncSimpleDB(object):
+    """asyncio counterpart of SimpleDB, for Postgres/SQLite3 databases
+
+    Arguments are as for SimpleDB, with dialect defaulting to the asyncio
+    driver for the server (see ASYNC_DIALECTS).  The database is connected
+    with `await db.connect()`, or by using `async with db:`.
+
+    tables      None to reflect all tables, or list of names of the
+                only tables to reflect.
+
+    Connection pool options are as for SimpleDB, except that pool='queue'
+    uses the asyncio queue pool.  The SimpleDB-only options logfile,
+    schema_cache, info_cache_ttl and instrument are accepted, so that
+    the same credentials can be used, and ignored.
+    """
+    def __init__(self, dbname=None, server='postgresql', user='',
+                 password='', host='', port=None, dialect=None,
+                 pool=None, pool_size=None, max_overflow=None,
+                 pool_timeout=None, pool_recycle=None, pool_pre_ping=None,
+                 tables=None, logfile=None, schema_cache=None,
+                 info_cache_ttl=None, instrument=False):
+        self.dbname = dbname
+        self.server = server
+        self.engine = None
+        self.metadata = None
+        self.tables = None
+        self._connect_kws = dict(server=server, user=user, password=password,
+                                 host=host, port=port, dialect=dialect,
+                                 pool=pool, pool_size=pool_size, max_overflow=max_overflow,
+                                 pool_timeout=pool_timeout,
+                                 pool_recycle=pool_recycle,
+                                 pool_pre_ping=pool_pre_ping, tables=tables)
+        self._stmt_cache = {}
+        self._stmt_cache_stats = {'hits': 0, 'misses': 0}
+        self._where_colnames = {}
+        self._unique_keys = {}
+        # current transaction() of each asyncio task
+        self._txn = contextvars.ContextVar(f'asyncdb_txn_{id(self)}',
+                                           default=None)
+
+    # statement building is shared with SimpleDB
+    table_error = SimpleDB.table_error
+    _where_items = SimpleDB._where_items
+    handle_where = SimpleDB.handle_where
+    _select_query = SimpleDB._select_query
+    statement_cache_info = SimpleDB.statement_cache_info
+    clear_statement_cache = SimpleDB.clear_statement_cache
+    has_unique_key = SimpleDB.has_unique_key
+    _has_unique_key = SimpleDB._has_unique_key
+    _upsert_query = SimpleDB._upsert_query
+    _insert_many_batch = SimpleDB._insert_many_batch
+    _info_query = SimpleDB._info_query
+
+    async def __aenter__(self):
+        if self.engine is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self, dbname=None, **kws):
+        """connect to an existing database, with arguments as for __init__"""
+        if dbname is None:
+            dbname = self.dbname
+        self.dbname = dbname
+        opts = dict(self._connect_kws)
+        opts.update(kws)
+        server = opts.pop('server')
+        dialect = opts.pop('dialect')
+        tables = opts.pop('tables')
+        if dialect is None:
+            dialect = ASYNC_DIALECTS.get(server_name(server), None)
+        connect_str, connect_args = connect_url(dbname, server=server,
+                                                user=opts.pop('user'),
+                                                password=opts.pop('password'),
+                                                port=opts.pop('port'),
+                                                host=opts.pop('host'),
+                                                dialect=dialect)
+        pool_kws = pool_engine_args(**opts)
+        if pool_kws.get('poolclass', None) is QueuePool:
+            # the default for async engines, AsyncAdaptedQueuePool
+            pool_kws.pop('poolclass')
+        self.engine = create_async_engine(connect_str,
+                                          connect_args=connect_args, **pool_kws)
+        self.metadata = MetaData()
+        only = None if tables is None else list(tables)
+        try:
+            async with self.engine.connect() as conn:
+                await conn.run_sync(lambda sconn: self.metadata.reflect(bind=sconn, only=only))
+        except:
+            raise ValueError(f'{dbname:s} is not a valid database')
+        self.tables = self.metadata.tables
+        self._stmt_cache = {}
+        self._where_colnames = {}
+        self._unique_keys = {}
+
+    async def close(self):
+        "close all connections"
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """async context manager for a unit of work, as for
+        SimpleDB.transaction():
+
+        >>> async with db.transaction():
+        ...     await db.insert('person', badge=1234, last_name='Smith')
+        ...     await db.update('proposal', where={'id': 1001}, spokesperson_id=9)
+
+        Transactions are per asyncio task: queries awaited in the block
+        share one connection and are committed together.
+        """
+        txn = self._txn.get()
+        if txn is not None:
+            yield txn['session']
+            return
+
+        async with AsyncSession(self.engine) as session:
+            txn = {'session': session, 'modify_date': False}
+            token = self._txn.set(txn)
+            try:
+                async with session.begin():
+                    yield session
+                    if txn['modify_date']:
+                        query = self._modify_date_query()
+                        if query is not None:
+                            await session.execute(query)
+            finally:
+                self._txn.reset(token)
+
+    def _modify_date_query(self):
+        tab = self.tables.get('info', None)
+        if tab is None:
+            return None
+        vals = {'key': 'modify_date', 'value': isotime()}
+        if 'modify_time' in tab.c:
+            vals['modify_time'] = datetime.now()
+        query = self._upsert_query(tab, ('key',), vals.keys())
+        if query is None:
+            query = tab.update().where(tab.c.key=='modify_date')
+        return query.values(**vals)
+
+    async def execute(self, query, set_modify_date=False, params=None):
+        """execute a query, optionally setting 'modify date', and
+        return the (buffered) result"""
+        return await self.execute_batch([(query, params)],
+                                        set_modify_date=set_modify_date)
+
+    async def execute_batch(self, queries, set_modify_date=False):
+        """execute a list of (query, params) pairs in a single transaction,
+        returning the result of the last query"""
+        result = None
+        txn = self._txn.get()
+        if txn is not None:
+            for query, params in queries:
+                result = await txn['session'].execute(query, params)
+            if set_modify_date:
+                txn['modify_date'] = True
+            return result
+
+        async with AsyncSession(self.engine) as session, session.begin():
+            for query, params in queries:
+                result = await session.execute(query, params)
+            if set_modify_date:
+                query = self._modify_date_query()
+                if query is not None:
+                    await session.execute(query)
+        return result
+
+    async def get_rows(self, tablename, where=None, order_by=None,
+                       limit_one=False, none_if_empty=False, **kws):
+        """select rows of a table, as for SimpleDB.get_rows()"""
+        query, params = self._select_query(tablename, where=where,
+                                           order_by=order_by, limit_one=limit_one,
+                                           funcname='get_rows', **kws)
+        result = await self.execute(query, params=params)
+        if limit_one:
+            result = result.fetchone()
+        else:
+            result = result.fetchall()
+        if result is not None and len(result) == 0 and none_if_empty:
+            result = None
+        return result
+
+    async def get_row(self, tablename, where=None):
+        """get a single row or None if empty"""
+        return await self.get_rows(tablename, where=where, limit_one=True,
+                                   none_if_empty=True)
+
+    async def lookup(self, tablename, **kws):
+        """simple select of table with equality filter on columns by name"""
+        return await self.get_rows(tablename, **kws)
+
+    async def iter_rows(self, tablename, where=None, order_by=None,
+                        batch_size=1000, **kws):
+        """async iterator over rows of a table, streamed from the database
+        in batches of `batch_size` rows, as for SimpleDB.iter_rows()
+
+        >>> async for row in db.iter_rows('experiment_person', batch_size=5000):
+        ...     print(row.experiment_id, row.person_id)
+        """
+        query, params = self._select_query(tablename, where=where,
+                                           order_by=order_by,
+                                           funcname='iter_rows', **kws)
+        query = query.execution_options(yield_per=batch_size)
+        txn = self._txn.get()
+        if txn is not None:
+            conn = await txn['session'].connection()
+            result = await conn.stream(query, params)
+            async for row in result:
+                yield row
+            return
+        async with self.engine.connect() as conn:
+            result = await conn.stream(query, params)
+            async for row in result:
+                yield row
+
+    async def insert(self, tablename, **kws):
+        """insert to a table with keyword/value pairs"""
+        tab = self.tables[tablename]
+        await self.execute(tab.insert().values(**kws), set_modify_date=True)
+
+    async def insert_many(self, tablename, rows):
+        """insert a list of dicts to a table in one transaction, as for
+        SimpleDB.insert_many().  Returns the number of rows inserted."""
+        batch = self._insert_many_batch(tablename, rows)
+        if len(batch) == 0:
+            return 0
+        await self.execute_batch(batch, set_modify_date=True)
+        return sum(len(params) for query, params in batch)
+
+    async def update(self, tablename, where=None, **kws):
+        """update rows of a table selected by where (int for id, or dict)
+        with keyword/value pairs"""
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'update')
+        where = self.handle_where(tablename, where=where, funcname='update')
+        await self.execute(tab.update().where(where).values(**kws),
+                           set_modify_date=True)
+
+    async def delete_rows(self, tablename, where):
+        """delete rows of a table selected by where (int for id, or dict)"""
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'delete')
+        where = self.handle_where(tablename, where=where, funcname='delete')
+        await self.execute(tab.delete().where(where), set_modify_date=True)
+
+    async def get_info(self, key=None, default=None, prefix=None):
+        """get value from the info table for a key, or a dict of values
+        for all keys starting with prefix, or for all keys"""
+        tab = self.tables['info']
+        query = self._info_query(key=key, prefix=prefix)
+        if 'modify_time' in tab.c:
+            query = query.order_by(tab.c.modify_time)
+        rows = (await self.execute(query)).fetchall()
+        if key is not None:
+            return rows[-1].value if len(rows) > 0 else default
+        return {row.key: row.value for row in rows}
+
+    async def set_info(self, key, value):
+        """set key / value in the info table"""
+        tab = self.tables['info']
+        vals = {'key': key, 'value': value}
+        if 'modify_time' in tab.c:
+            vals['modify_time'] = datetime.now()
+        query = self._upsert_query(tab, ('key',), vals.keys())
+        if query is None:
+            async with self.transaction():
+                if await self.get_row('info', where={'key': key}) is None:
+                    query = tab.insert()
+                else:
+                    query = tab.update().where(tab.c.key==key)
+                await self.execute(query.values(**vals), set_modify_date=True)
+        else:
+            await self.execute(query.values(**vals), set_modify_date=True)
+
+
+class AsyncBeamtimeDB(AsyncSimpleDB):
+    """asyncio counterpart of BeamtimeDB, for read-mostly services
+    such as dashboards
+
+    With dbname=None, connection settings are read from the
+    BEAMTIMEDB_CREDENTIALS file, as for BeamtimeDB.
+    """
+    def __init__(self, dbname=None, server='postgresql', **kws):
+        if dbname is None:
+            conndict = get_credentials(envvar='BEAMTIMEDB_CREDENTIALS')
+            if 'dbname' in conndict:
+                dbname = conndict.pop('dbname')
+            if 'server' in conndict:
+                server = conndict.pop('server')
+            kws.update(conndict)
+        AsyncSimpleDB.__init__(self, dbname=dbname, server=server, **kws)
+
+    async def get_user(self, id=None, badge=None, email=None, orcid=None):
+        """get user (one only) matching id, badge, email, or orcid,
+        or return None if not found"""
+        where = {}
+        for key, val in (('id', id), ('badge', badge), ('email', email),
+                         ('orcid', orcid)):
+            if val is not None:
+                where[key] = val
+        return await self.get_row('person', where=where)
+
+    async def get_proposal(self, prop_id):
+        "get proposal by ID, or None"
+        return await self.get_row('proposal', where={'id': prop_id})
+
+    async def get_experiment(self, esaf_id):
+        "get experiment by ID (ESAF Number), or None"
+        return await self.get_row('experiment', where={'id': esaf_id})
+
+    async def get_current_experiments(self, beamline=None, when=None):
+        """get experiments running at a time (default: now),
+        optionally for one beamline (apsbss_beamline name)"""
+        if when is None:
+            when = datetime.now()
+        tab = self.tables['experiment']
+        query = tab.select().where(tab.c.start_date <= when,
+                                   tab.c.end_date >= when)
+        if beamline is not None:
+            row = await self.get_row('apsbss_beamline', where={'name': beamline})
+            if row is None:
+                return []
+            query = query.where(tab.c.beamline_id==row.id)
+        result = await self.execute(query.order_by(tab.c.start_date))
+        return result.fetchall()
@@ -10,6 +10,7 @@ import sys
 import json
 import time
 import logging
+import threading
 from pathlib import Path
 import numpy as np
 from socket import gethostname
@@ -18,6 +19,7 @@ import yaml
 from charset_normalizer import from_bytes
 
 import epics
+from sqlalchemy import select, literal, union_all
 
 from .schema import create_beamtimedb
 from .simpledb import SimpleDB, isotime
@@ -26,6 +28,12 @@ from .simpledb import SimpleDB, isotime
 BEAMLINE_ALIASES =  {'13idd': '13idcd',
                      '13idc': '13idcd'}
 
+# small enumeration tables cached by LookupCache
+LOOKUP_TABLES = ('run', 'esaf_type', 'esaf_status', 'apsbss_beamline')
+
+# process-wide LookupCaches, keyed by database URL
+_SHARED_LOOKUPS = {}
+
 def get_credentials(envvar='BEAMTIMEDB_CREDENTIALS'):
     """look up credentials file from environment variable"""
     conn = {}
@@ -64,12 +72,71 @@ def make_datetime(t=None, iso=False):
         return datetime.isoformat(dt)
     return dt
 
+class LookupCache(object):
+    """bidirectional name <-> id cache for small enumeration tables
+    (run, esaf_type, esaf_status, apsbss_beamline) that rarely change.
+
+    All tables are read with one query when first used, and new values
+    are added as they are written.  Use invalidate() to force a re-read.
+    """
+    def __init__(self, tables=LOOKUP_TABLES):
+        self.tables = tuple(tables)
+        self.ids = {}
+        self.names = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def load(self, db):
+        "read all lookup tables with a single UNION ALL query"
+        with self.lock:
+            queries = []
+            for tname in self.tables:
+                if tname in db.tables:
+                    tab = db.tables[tname]
+                    queries.append(select(literal(tname).label('tablename'),
+                                          tab.c.id, tab.c.name))
+            self.ids, self.names = {}, {}
+            if len(queries) > 0:
+                for row in db.execute(union_all(*queries)).fetchall():
+                    self.add(row.tablename, row.id, row.name)
+            self.loaded = True
+
+    def add(self, table, id, name):
+        "add (or replace) a table / id / name entry"
+        with self.lock:
+            self.ids[(table, name)] = id
+            self.names[(table, id)] = name
+
+    def get_id(self, db, table, name):
+        "id for name in table, or None if not known"
+        if not self.loaded:
+            self.load(db)
+        return self.ids.get((table, name), None)
+
+    def get_name(self, db, table, id):
+        "name for id in table, or None if not known"
+        if not self.loaded:
+            self.load(db)
+        return self.names.get((table, id), None)
+
+    def invalidate(self, table=None):
+        """discard cached values, for one table or (default) all tables.
+        All tables are re-read with one query when next used."""
+        with self.lock:
+            if table is None:
+                self.ids, self.names = {}, {}
+            else:
+                self.ids = {k: v for k, v in self.ids.items() if k[0] != table}
+                self.names = {k: v for k, v in self.names.items() if k[0] != table}
+            self.loaded = False
+
 
 class BeamtimeDB(SimpleDB):
     """
     Main Interface to beamtimeDB
     """
-    def __init__(self, dbname=None, server='postgresql', create=False, **kws):
+    def __init__(self, dbname=None, server='postgresql', create=False,
+                 shared_lookups=False, **kws):
         if dbname is None:
             conndict = get_credentials(envvar='BEAMTIMEDB_CREDENTIALS')
             if 'dbname' in conndict:
@@ -86,14 +153,56 @@ class BeamtimeDB(SimpleDB):
         if create:
             create_beamtimedb(dbname, server=self.server, create=True, **kws)
         SimpleDB.__init__(self, dbname=self.dbname, server=self.server, **kws)
-
-        self.beamline_names = {}
-        for row in self.get_rows('apsbss_beamline'):
-            if row.name is not None:
-                name = row.name.lower().replace('-', '').replace(',', '')
-                self.beamline_names[name] = row.id
-        for key, val in BEAMLINE_ALIASES.items():
-            self.beamline_names[key] = self.beamline_names.get(val, None)
+        self._beamline_names = None
+        if shared_lookups:
+            url = self.engine.url.render_as_string(hide_password=True)
+            self.lookups = _SHARED_LOOKUPS.setdefault(url, LookupCache())
+        else:
+            self.lookups = LookupCache()
+
+    def invalidate_lookups(self, table=None):
+        """discard cached lookup-table values (see LookupCache),
+        for one table or (default) all tables"""
+        self.lookups.invalidate(table=table)
+        if table in (None, 'apsbss_beamline'):
+            self._beamline_names = None
+
+    def on_rollback(self):
+        "discard lookup values that may have been written in a failed transaction"
+        SimpleDB.on_rollback(self)
+        self.invalidate_lookups()
+
+    def lookup_id(self, table, name):
+        """get id for a name in a lookup table (run, esaf_type, esaf_status,
+        apsbss_beamline), or None if not found"""
+        if table not in self.lookups.tables:
+            row = self.get_row(table, where={'name': name})
+            return None if row is None else row.id
+        return self.lookups.get_id(self, table, name)
+
+    def lookup_name(self, table, id):
+        """get name for an id in a lookup table, or None if not found"""
+        if table not in self.lookups.tables:
+            row = self.get_row(table, where={'id': id})
+            return None if row is None else row.name
+        return self.lookups.get_name(self, table, id)
+
+    @property
+    def beamline_names(self):
+        """dict of normalized beamline name: apsbss_beamline id,
+        read from the database when first used"""
+        if self._beamline_names is None:
+            if not self.lookups.loaded:
+                self.lookups.load(self)
+            names = {}
+            for (table, bname), bid in list(self.lookups.ids.items()):
+                if table == 'apsbss_beamline' and bname is not None:
+                    name = bname.lower().replace('-', '').replace(',', '')
+                    names[name] = bid
+            for key, val in BEAMLINE_ALIASES.items():
+                names[key] = names.get(val, None)
+            self._beamline_names = names
+        return self._beamline_names
 
     def create_newdb(self, dbname, connect=False, **kws):
         "create a new, empty database"
@@ -166,11 +275,7 @@ class BeamtimeDB(SimpleDB):
         #if affiliation is not None:
         #    inst = self.add_affiliation(affiliation, warn=False)
         #    kws['affiliation'] = inst.id
-        cur = self.get_user(badge=badge)
-        if cur is None:
-            self.add_row('person', **kws)
-            cur = self.get_user(badge=badge)
-        return cur
+        return self.upsert('person', 'badge', update_existing=False, **kws)
 
     def get_institution(self, name, city=None, country=None):
         where = {'name': name}
@@ -182,30 +287,31 @@ class BeamtimeDB(SimpleDB):
         return self.get_row('institution', where=where)
 
     def add_institution(self, name, city=None, country=None, warn=False):
-        cur = self.get_institution(name, city=city, country=country)
-        if warn and cur is not None:
+        if warn and self.get_institution(name, city=city, country=country) is not None:
             print(f"Warning: institution '{name}' exists")
-        if cur is None:
-            kws = {'name': name}                          
-            if city is not None:
-                kws['city'] = city
-            if country is not None:
-                kws['country'] = country
-
-            self.add_row('institution', **kws)
-            cur = self.get_institution(name, city=city, country=country)
-        return cur
+        kws = {'name': name}
+        if city is not None:
+            kws['city'] = city
+        if country is not None:
+            kws['country'] = country
+        return self.upsert('institution', tuple(kws.keys()),
+                           update_existing=False, **kws)
 
    
     def _getid(self, table, value, key='name'):
-        """ generic  get-id-by-name"""
-        kws = {key: value}
-        row = self.get_row(table, where=kws)
-        if row is None:
-            self.add_row(table, **kws)
-            row = self.get_row(table, where=kws)
+        """ generic  get-id-by-name, adding the value if needed"""
+        cached = key == 'name' and table in self.lookups.tables
+        if cached:
+            rowid = self.lookups.get_id(self, table, value)
+            if rowid is not None:
+                return rowid
+        row = self.upsert(table, key, update_existing=False, **{key: value})
         if row is None:
             raise ValueError(f"could not get or add {table} {key}={value}")
+        if cached:
+            self.lookups.add(table, row.id, value)
+            if table == 'apsbss_beamline':
+                self._beamline_names = None
         return row.id
 
    
@@ -217,18 +323,12 @@ class BeamtimeDB(SimpleDB):
 
     def add_proposal(self, prop_id, title=None, spokesperson_id=None):
         print("Add Proposal " , prop_id, title, spokesperson_id)
-        prop = self.get_proposal(prop_id)
-        if prop is None:
-            print("add proposal....")
-            kws = {'id': prop_id}
-            if title is not None:
-                kws['title'] = title
-            if spokesperson_id is not None:
-                kws['spokesperson_id'] = spokesperson_id
-                
-            self.add_row('proposal', **kws)
-            prop = self.get_proposal(prop_id)
-        return prop
+        kws = {'id': prop_id}
+        if title is not None:
+            kws['title'] = title
+        if spokesperson_id is not None:
+            kws['spokesperson_id'] = spokesperson_id
+        return self.upsert('proposal', 'id', update_existing=False, **kws)
 
 
     def get_experiment(self, esaf_id):
@@ -247,30 +347,72 @@ class BeamtimeDB(SimpleDB):
                        pvlog_template_file=None, esaf_pdf_file=None,
                        proposal_pdf_file=None):
         
-        esaf = self.get_experiment(esaf_id)
-        if esaf is not None:
-            raise ValueError(f"experiment {esaf_id} exists")
-        print("add experiment....")
-        sperson = self.get_user(id=spokesperson)
-
-        kws ={'id': esaf_id,
-              'run_id': self._getid('run', run),
-              'esaf_type_id':  self._getid('esaf_type', esaf_type),
-              'esaf_status_id':  self._getid('esaf_status', esaf_status),
-              'esaf_type_id':  self._getid('esaf_type', esaf_type),
-              'spokesperson_id': spokesperson,
-              'beamline_id':  self._getid('apsbss_beamline', beamline),
-              'title': title,
-              'description': description,
-              'start_date': start_date,
-              'end_date': end_date,
-              }
-        
-        self.add_row('experiment', **kws)
-        exp_id = self.get_experiment(esaf_id).id
-        for uid in users:
-            self.add_row('experiment_person', experiment_id=exp_id,
-                         person_id=uid)
+        with self.transaction():
+            esaf = self.get_experiment(esaf_id)
+            if esaf is not None:
+                raise ValueError(f"experiment {esaf_id} exists")
+            print("add experiment....")
+
+            kws ={'id': esaf_id,
+                  'run_id': self._getid('run', run),
+                  'esaf_type_id':  self._getid('esaf_type', esaf_type),
+                  'esaf_status_id':  self._getid('esaf_status', esaf_status),
+                  'spokesperson_id': spokesperson,
+                  'beamline_id':  None,
+                  'title': title,
+                  'description': description,
+                  'start_date': start_date,
+                  'end_date': end_date,
+                  }
+
+            if beamline is not None:
+                kws['beamline_id'] = self._getid('apsbss_beamline', beamline)
+            self.add_row('experiment', **kws)
+            exp_id = self.get_experiment(esaf_id).id
+            if users is not None:
+                self.insert_many('experiment_person',
+                                 [{'experiment_id': exp_id, 'person_id': uid}
+                                  for uid in users])
+
+    def update_experiment(self, esaf_id, run=None, esaf_status=None,
+                          esaf_type=None, beamline=None, spokesperson=None,
+                          users=None, **kws):
+        """update an existing experiment, setting only the values given:
+        run, esaf_status, esaf_type, and beamline are names, spokesperson
+        is a person id, users is a list of person ids, and other keyword
+        arguments are experiment columns (title, start_date, ...).
+        """
+        with self.transaction():
+            for key, table, val in (('run_id', 'run', run),
+                                    ('esaf_status_id', 'esaf_status', esaf_status),
+                                    ('esaf_type_id', 'esaf_type', esaf_type),
+                                    ('beamline_id', 'apsbss_beamline', beamline)):
+                if val is not None:
+                    kws[key] = self._getid(table, val)
+            if spokesperson is not None:
+                kws['spokesperson_id'] = spokesperson
+            if len(kws) > 0:
+                self.update('experiment', where={'id': esaf_id}, **kws)
+            if users is not None:
+                self.set_experiment_users(esaf_id, users)
+
+    def set_experiment_users(self, esaf_id, users):
+        """set the people (list of person ids) for an experiment,
+        adding and removing only the changed experiment_person links"""
+        with self.transaction():
+            current = set(row.person_id for row in
+                          self.get_rows('experiment_person',
+                                        where={'experiment_id': esaf_id}))
+            users = set(users)
+            removed = current - users
+            if len(removed) > 0:
+                self.delete_rows('experiment_person',
+                                 {'experiment_id': esaf_id, 'person_id': list(removed)})
+            added = users - current
+            if len(added) > 0:
+                self.insert_many('experiment_person',
+                                 [{'experiment_id': esaf_id, 'person_id': uid}
+                                  for uid in sorted(added)])
 
     def match_beamline(self, blname):
         "match beamline name to beamline row, allowing name variations"
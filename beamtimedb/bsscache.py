@@ -0,0 +1,161 @@
+"""
+on-disk cache of APS BSS responses.
+
+A CachedBSSServer wraps an APS BSS Server (or FakeBSSServer) and saves
+each response (ESAFs for a sector and run, proposals for a beamline and
+run) to a gzip-compressed pickle file, keyed by (sector, beamline, run,
+endpoint):
+
+   bss = CachedBSSServer(connect_bss(bt_db))
+   filldb_from_apsbss(run='2024-2', bt_db=bt_db, bss_server=bss)
+
+Responses for closed runs (runs before the current run) never expire.
+Responses for the current run expire after `ttl` seconds.
+
+With offline=True, no server is needed, and all responses come from the
+cache, whatever their age, so that past runs can be re-synced without
+network access:
+
+   bss = CachedBSSServer(None, offline=True)
+"""
+import os
+import gzip
+import time
+import pickle
+import logging
+import threading
+
+from .use_apsbss import BEAMLINES
+
+# seconds before cached responses for the current run expire
+CURRENT_RUN_TTL = 600
+
+
+def bss_cache_folder():
+    """default folder for cached APS BSS responses, from the environment
+    variable BEAMTIMEDB_BSS_CACHE, or ~/.cache/beamtimedb/bss"""
+    folder = os.environ.get('BEAMTIMEDB_BSS_CACHE', None)
+    if folder is None:
+        top = os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache'))
+        folder = os.path.join(top, 'beamtimedb', 'bss')
+    return os.path.expanduser(folder)
+
+
+def sector_for_beamline(beamline):
+    "sector name for a beamline name"
+    for sector, beamlines in BEAMLINES.items():
+        if beamline in beamlines.values():
+            return sector
+    return beamline.split('-')[0]
+
+
+class CachedBSSServer(object):
+    """APS BSS Server with responses cached on disk
+
+    Arguments
+    ----------
+    server       APS BSS Server, or None for offline use
+    folder       cache folder [None, use bss_cache_folder()]
+    ttl          seconds before responses for the current run expire
+                 [CURRENT_RUN_TTL]
+    offline      whether to use only cached responses [False]
+    """
+    def __init__(self, server=None, folder=None, ttl=CURRENT_RUN_TTL,
+                 offline=False):
+        if server is None and not offline:
+            raise ValueError('CachedBSSServer needs a server unless offline')
+        self.server = server
+        self.folder = bss_cache_folder() if folder is None else folder
+        self.ttl = ttl
+        self.offline = offline
+        self.counts = {'hits': 0, 'misses': 0}
+        self._current_run = None
+
+    def cachefile(self, sector, beamline, run, endpoint):
+        "cache file name for a response"
+        fname = f"{endpoint}_{beamline or 'all'}.pkl.gz"
+        fname = fname.replace(',', '_').replace('/', '_')
+        return os.path.join(self.folder, str(sector), str(run), fname)
+
+    def _read(self, cachefile, max_age=None):
+        if not os.path.exists(cachefile):
+            return None
+        if (max_age is not None and
+            time.time() - os.path.getmtime(cachefile) > max_age):
+            return None
+        try:
+            with gzip.open(cachefile, 'rb') as fh:
+                return pickle.load(fh)
+        except Exception:
+            logging.getLogger(__name__).warning(f'could not read BSS cache {cachefile}')
+            return None
+
+    def _write(self, cachefile, value):
+        try:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            tmpfile = f'{cachefile}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with gzip.open(tmpfile, 'wb') as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpfile, cachefile)
+        except Exception:
+            logging.getLogger(__name__).warning(f'could not write BSS cache {cachefile}')
+
+    def is_closed(self, run):
+        "whether a run is before the current run, so will not change"
+        return run is not None and str(run) < str(self.current_run)
+
+    def _cached(self, sector, beamline, run, endpoint, fetch):
+        cachefile = self.cachefile(sector, beamline, run, endpoint)
+        max_age = None
+        if not (self.offline or self.is_closed(run)):
+            max_age = self.ttl
+        value = self._read(cachefile, max_age=max_age)
+        if value is not None:
+            self.counts['hits'] += 1
+            return value
+        if self.offline:
+            raise ValueError(f'no cached APS BSS {endpoint} for {sector=}, {beamline=}, {run=}')
+        self.counts['misses'] += 1
+        value = fetch()
+        self._write(cachefile, value)
+        return value
+
+    @property
+    def current_run(self):
+        "name of current run"
+        if self._current_run is None:
+            cachefile = os.path.join(self.folder, 'current_run.pkl.gz')
+            if self.offline:
+                self._current_run = self._read(cachefile)
+                if self._current_run is None:
+                    raise ValueError('no cached APS BSS current run')
+            else:
+                self._current_run = self.server.current_run
+                self._write(cachefile, self._current_run)
+        return self._current_run
+
+    def esafs(self, sector, run=None):
+        "all ESAFs for a sector and run"
+        if run is None:
+            run = self.current_run
+        return self._cached(sector, None, run, 'esafs',
+                            lambda: self.server.esafs(sector, run=run))
+
+    def current_esafs(self, sector):
+        "ESAFs for a sector for the current run"
+        return self._cached(sector, None, self.current_run, 'current_esafs',
+                            lambda: self.server.current_esafs(sector))
+
+    def proposals(self, beamline, run=None):
+        "dict of proposals for a beamline and run"
+        if run is None:
+            run = self.current_run
+        return self._cached(sector_for_beamline(beamline), beamline, run,
+                            'proposals',
+                            lambda: self.server.proposals(beamline, run=run))
+
+    def current_proposals(self, beamline):
+        "dict of proposals for a beamline for the current run"
+        return self._cached(sector_for_beamline(beamline), beamline,
+                            self.current_run, 'current_proposals',
+                            lambda: self.server.current_proposals(beamline))
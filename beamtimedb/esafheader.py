@@ -0,0 +1,126 @@
+"""
+parse the header at the top of the first page of an ESAF PDF:
+
+   Printed date: 08/01/2026 10:00:00
+   PEN: 13-ID-E-0003 Experiment ID: 260003 (GUP)
+   ID Start Date: 08/18/2026 08:00:00 ID End Date: 08/24/2026 08:00:00
+   Spokesperson: Alex Smith GUP ID: 90003
+
+into an ESAFHeader record, with integer ids and datetimes, in a single
+pass over the text, using one precompiled pattern:
+
+   header = parse_esaf_header_text(page1_text)
+   print(header.experiment_id, header.beamline, header.start_date)
+
+Text can be a string or an iterable of lines.  parse_esaf_headers()
+parses a list of texts, as from many PDFs.
+"""
+import re
+from datetime import datetime
+from collections import namedtuple
+from dateutil.parser import parse as dateparse
+
+HEADER_FIELDS = ('experiment_id', 'proposal_id', 'beamline', 'experiment_type',
+                 'start_date', 'end_date', 'spokesperson', 'pen_key',
+                 'printed_date')
+
+# header values needed for each ESAF
+REQUIRED_FIELDS = ('beamline', 'experiment_id', 'proposal_id',
+                   'start_date', 'end_date')
+
+HEADER_LINE = re.compile(r"""^[ \t]*(?:
+    Printed\ date:[ \t]*(?P<printed>.*?)
+  | PEN:[ \t]*(?P<pen>\S+)[ \t]+Experiment\ ID:[ \t]*(?P<expid>\d+)
+        (?:[ \t]*\([ \t]*(?P<etype>[^)]*?)[ \t]*\))?
+  | (?:ID|BM)\ Start\ Date:[ \t]*(?P<start>.*?)[ \t]*(?:ID|BM)\ End\ Date:[ \t]*(?P<end>.*?)
+  | Spokesperson:[ \t]*(?P<spokes>.*?)[ \t]*GUP\ ID:[ \t]*(?P<gup>\d+)
+)[ \t]*$""", re.MULTILINE | re.VERBOSE)
+
+# dates as '08/18/2026 08:00:00', '08/18/2026 8:00 AM', or '2026-08-18 08:00'
+DATE_PATTERN = re.compile(r"""^(?:(?P<mon>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})
+                               |(?P<iyear>\d{4})-(?P<imon>\d{1,2})-(?P<iday>\d{1,2}))
+    (?:[ T]+(?P<hour>\d{1,2}):(?P<min>\d{2})(?::(?P<sec>\d{2}))?
+       (?:\s*(?P<ampm>[AaPp][Mm]))?)?$""", re.VERBOSE)
+
+
+class ESAFHeader(namedtuple('ESAFHeader', HEADER_FIELDS,
+                            defaults=(None,)*len(HEADER_FIELDS))):
+    """values from the header of an ESAF PDF:
+
+    experiment_id    ESAF number (int)
+    proposal_id      GUP proposal number (int)
+    beamline         beamline, as '13-ID'
+    experiment_type  ESAF type, as 'GUP'
+    start_date       start time (datetime)
+    end_date         end time (datetime)
+    spokesperson     name of spokesperson
+    pen_key          full PEN key, as '13-ID-E-0003'
+    printed_date     time the ESAF was printed (datetime)
+    """
+    __slots__ = ()
+
+    def missing(self, fields=REQUIRED_FIELDS):
+        "list of fields without values"
+        return [name for name in fields if getattr(self, name) is None]
+
+
+def parse_datetime(text):
+    "datetime for a date string from an ESAF header, or None"
+    if text is None:
+        return None
+    text = text.strip()
+    match = DATE_PATTERN.match(text)
+    if match is None:
+        try:
+            return dateparse(text)
+        except (ValueError, OverflowError):
+            return None
+    year, mon, day, hour, minute, sec, ampm = match.group('year', 'mon', 'day',
+                                                          'hour', 'min', 'sec', 'ampm')
+    if year is None:
+        year, mon, day = match.group('iyear', 'imon', 'iday')
+    hour = 0 if hour is None else int(hour)
+    if ampm is not None:
+        hour = hour % 12 + (12 if ampm.lower() == 'pm' else 0)
+    try:
+        return datetime(int(year), int(mon), int(day), hour,
+                        int(minute or 0), int(sec or 0))
+    except ValueError:
+        return None
+
+
+def _matches(text):
+    if isinstance(text, str):
+        return HEADER_LINE.finditer(text)
+    return (m for m in map(HEADER_LINE.match, text) if m is not None)
+
+
+def parse_esaf_header_text(text):
+    """parse header of an ESAF from the text of the first page
+    (string or iterable of lines), returning an ESAFHeader.
+    Lines are read only until all header values are found."""
+    vals = {}
+    for match in _matches(text):
+        kind = match.lastgroup
+        if kind == 'printed':
+            vals['printed_date'] = parse_datetime(match.group('printed'))
+        elif kind in ('expid', 'etype'):
+            pen_key = match.group('pen')
+            vals['pen_key'] = pen_key
+            vals['beamline'] = '-'.join(pen_key.split('-')[:2])
+            vals['experiment_id'] = int(match.group('expid'))
+            vals['experiment_type'] = match.group('etype')
+        elif kind == 'end':
+            vals['start_date'] = parse_datetime(match.group('start'))
+            vals['end_date'] = parse_datetime(match.group('end'))
+        elif kind == 'gup':
+            vals['spokesperson'] = match.group('spokes')
+            vals['proposal_id'] = int(match.group('gup'))
+        if len(vals) == len(HEADER_FIELDS):
+            break
+    return ESAFHeader(**vals)
+
+
+def parse_esaf_headers(texts):
+    "parse a list of texts of ESAF first pages, returning list of ESAFHeaders"
+    return [parse_esaf_header_text(text) for text in texts]
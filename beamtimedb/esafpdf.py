@@ -2,62 +2,120 @@
 extract some information from text from ESAF PDF
 """
 
+import os
+import re
+import mmap
+import hashlib
 from glob import glob
+from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from pypdf import PdfReader
 from .beamtimedb import BeamtimeDB
+from .schema import add_esaf_pdf_manifest_table
+from .esafheader import ESAFHeader, parse_esaf_header_text, REQUIRED_FIELDS
 
-def read_esaf_header(filename):
-    """return dictionary of data from the top of the 
-    first page of an ESAF PDF
+# beamline folders in each run folder of esaf_pdf_folder
+PDF_FOLDERS = ('BMC', 'BMD', 'ID CD', 'IDE')
+
+# header values kept in esaf_pdf_manifest
+MANIFEST_FIELDS = ('experiment_id', 'proposal_id', 'beamline', 'experiment_type',
+                   'start_date', 'end_date', 'spokesperson')
+
+# update_experiments() outcomes retried from the manifest on each scan
+RETRY_OUTCOMES = ('unknown_proposal', 'unknown_experiment')
+
+# content stream tokens: literal strings, TJ arrays, text positioning
+# (with operands) and text showing / line operators
+CONTENT_TOKENS = re.compile(rb"""
+    (?P<str>\((?:\\.|[^\\)])*\))
+  | (?P<arr>\[(?:\((?:\\.|[^\\)])*\)|[^\]()])*\])
+  | (?P<td>-?[\d.]+)\s+(?P<ty>-?[\d.]+)\s+T[dD](?![A-Za-z])
+  | (?P<tm>(?:-?[\d.]+\s+){5})(?P<tmy>-?[\d.]+)\s+Tm(?![A-Za-z])
+  | (?P<op>T\*|Tj|TJ|ET|'|")
+""", re.VERBOSE | re.DOTALL)
+
+PDF_STRING_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b',
+                      b'f': b'\f', b'(': b'(', b')': b')', b'\\': b'\\'}
+
+def _pdf_string(raw):
+    "decode a PDF literal string, without the enclosing parentheses"
+    def unescape(match):
+        esc = match.group(1)
+        if esc[:1].isdigit():
+            return bytes([int(esc, 8) & 255])
+        return PDF_STRING_ESCAPES.get(esc, esc)
+    raw = re.sub(rb'\\([0-7]{1,3}|.)', unescape, raw, flags=re.DOTALL)
+    return raw.decode('latin-1')
+
+def iter_content_lines(content):
+    """iterate over lines of text shown by a PDF content stream (bytes),
+    for simply encoded text only, as in the header of an ESAF PDF"""
+    line, strings, ypos = [], [], None
+    for match in CONTENT_TOKENS.finditer(content):
+        kind = match.lastgroup
+        if kind == 'str':
+            strings = [match.group('str')[1:-1]]
+        elif kind == 'arr':
+            strings = []
+            for part in re.finditer(rb'\(((?:\\.|[^\\)])*)\)|(-?[\d.]+)',
+                                    match.group('arr')[1:-1]):
+                if part.group(1) is not None:
+                    strings.append(part.group(1))
+                elif float(part.group(2)) < -200:
+                    strings.append(b' ')
+        elif kind in ('ty', 'tmy'):
+            ynew = float(match.group(kind))
+            if (kind == 'ty' and ynew == 0) or (kind == 'tmy' and ynew == ypos):
+                # move along the same line: separate words
+                if len(line) > 0 and not line[-1].endswith(' '):
+                    line.append(' ')
+                continue
+            ypos = ynew
+            if len(line) > 0:
+                yield ''.join(line)
+                line = []
+        else:
+            op = match.group('op')
+            if op in (b'T*', b"'", b'"', b'ET') and len(line) > 0:
+                yield ''.join(line)
+                line = []
+            if op in (b'Tj', b'TJ', b"'", b'"'):
+                line.extend(_pdf_string(s) for s in strings)
+                strings = []
+    if len(line) > 0:
+        yield ''.join(line)
+
+def read_page1_content(filename):
+    """return the (decoded) content stream of the first page of a PDF,
+    reading the file through a memory map, closed on return"""
+    with open(filename, mode='rb') as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mmap_in:
+            with PdfReader(mmap_in) as pdf_reader:
+                contents = pdf_reader.pages[0].get_contents()
+                return b'' if contents is None else contents.get_data()
+
+def read_esaf_header(filename, fast=True):
+    """return ESAFHeader of values from the top of the
+    first page of an ESAF PDF (see esafheader)
+
+    With fast=True, the header lines are taken from the text operators of
+    the first page content stream.  This falls back to full text extraction
+    with pypdf if any of REQUIRED_FIELDS is not found.
     """
-    print(f" READ PDF HEADER {filename=}")
-    pdf_reader = PdfReader(open(filename, mode='rb'))
-    page1_text = pdf_reader.pages[0].extract_text()
-   
-    data =  {'printed_date': None,
-             'beamline': None,
-             'pen_line': None,
-             'pen_key': None,
-             'experiment_id': None,
-             'proposal_id': None,
-             'start_datetime': None,
-             'end_datetime': None,
-             'spokesperson': None,
-             'experiment_type': None}
-    
-    for line in page1_text.split('\n'):
-        if line.startswith('Printed date:'):
-            words = line.split(':')
-            data['printed_date'] = words[1].strip()
-        elif line.startswith('PEN:'):
-            data['pen_line'] = line
-            if 'Experiment ID:' in line:
-                words = [s.strip() for s in line[4:].split('Experiment ID:')]
-                data['pen_key'] = words[0]
-                bwords = words[0].split('-')
-                data['beamline'] = '-'.join(bwords[:2])
-                ewords = words[1].split()
-                data['experiment_id'] = ewords[0].strip()
-                data['experiment_type'] = ewords[1].strip().replace('(','').replace(')','')
-        elif line.startswith('ID Start Date:'):
-            xline = line.replace('ID Start Date:', '')
-            words = xline.split('ID End Date:')
-            data['start_datetime'] = words[0].strip()
-            data['end_datetime'] = words[1].strip()
-        elif line.startswith('BM Start Date:'):
-            xline = line.replace('BM Start Date:', '')
-            words = xline.split('BM End Date:')
-            data['start_datetime'] = words[0].strip()
-            data['end_datetime'] = words[1].strip()
-
-        elif line.startswith('Spokesperson:'):
-            xline = line.replace('Spokesperson:', '')
-            words = xline.split('GUP ID:')
-            data['spokesperson'] = words[0].strip()
-            data['proposal_id'] = words[1].strip()
-    return data
+    if fast:
+        try:
+            header = parse_esaf_header_text(iter_content_lines(read_page1_content(filename)))
+        except Exception:
+            header = None
+        if header is not None and len(header.missing(REQUIRED_FIELDS)) == 0:
+            return header
+
+    with open(filename, mode='rb') as fh:
+        with PdfReader(fh) as pdf_reader:
+            page1_text = pdf_reader.pages[0].extract_text()
+    return parse_esaf_header_text(page1_text)
 
 
 BLNAMES = None
@@ -65,7 +123,7 @@ BLNAMES = None
 def get_beamline_names():
     """ lookup beamline names"""
     global BLNAMES
-    beamdb = BeamtimeDB()
+    beamdb = BeamtimeDB(tables=['info', 'apsbss_beamline'])
     BLNAMES = {}
     for row in beamdb.get_rows('apsbss_beamline'):
         if row.name is not None:
@@ -91,35 +149,255 @@ def match_beamline(blname):
         bid = BLNAMES.get('unknown', None)
     return bid
 
-def read_esaf_pdfs(run=None):
-    beamdb = get_beamline_names()
-    esaf_folder = beamdb.get_info('esaf_pdf_folder')
+def esaf_pdf_files(esaf_folder, run_name):
+    "list of ESAF PDF files for a run, in all beamline folders"
+    files = []
+    for bname in PDF_FOLDERS:
+        folder = Path(esaf_folder, run_name, bname)
+        for pdffile in sorted(glob(folder.as_posix() + '/*')):
+            if pdffile.endswith('.pdf'):
+                files.append(pdffile)
+    return files
+
+def parse_esaf_pdf(filename):
+    """read header of an ESAF PDF, returning (filename, ESAFHeader, error)
+    with error None or the error message if the file could not be read"""
+    try:
+        return filename, read_esaf_header(filename), None
+    except Exception as exc:
+        return filename, None, f'{exc.__class__.__name__}: {exc}'
+
+def iter_esaf_headers(files, workers=None):
+    """iterate over (filename, ESAFHeader, error) for ESAF PDF files, parsed
+    in order in this process if workers is None or 1, or in a pool of
+    `workers` processes (0 for one per CPU) as they are finished"""
+    if workers in (None, 1) or len(files) < 2:
+        for filename in files:
+            yield parse_esaf_pdf(filename)
+        return
+    if workers == 0:
+        workers = os.cpu_count()
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+        futures = [pool.submit(parse_esaf_pdf, fname) for fname in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+def file_hash(filename):
+    "sha1 hex digest of the contents of a file"
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1<<20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def manifest_row(pdffile, run_name, size, mtime, fhash, header, error):
+    "esaf_pdf_manifest row for a PDF file and its ESAFHeader"
+    row = {'path': pdffile, 'run': run_name, 'size': size,
+           'mtime': mtime, 'hash': fhash, 'error': error, 'outcome': None}
+    for name in MANIFEST_FIELDS:
+        row[name] = None if header is None else getattr(header, name)
+    return row
+
+def manifest_header(row):
+    "ESAFHeader from the header values of an esaf_pdf_manifest row"
+    return ESAFHeader(**{name: getattr(row, name) for name in MANIFEST_FIELDS})
+
+def update_experiments(beamdb, headers, run_id, outcomes=None):
+    """set proposal, beamline, and run of experiments from a list of
+    ESAFHeaders, with proposals and experiments looked up with one IN
+    query each, and all changed experiments updated in one transaction.
+
+    If several headers give the same experiment, the one with the latest
+    printed_date is used, or, for equal printed dates, the last in the list.
+
+    Returns dict of counts of experiments 'updated', 'skipped' (already
+    up to date), 'unknown_proposal', and 'unknown_experiment'.
+    If outcomes is a dict, it is filled with {experiment id: outcome},
+    with outcome one of these names.
+    """
+    if outcomes is None:
+        outcomes = {}
+    counts = {'updated': 0, 'skipped': 0, 'unknown_proposal': 0,
+              'unknown_experiment': 0}
+    byexpt = {}
+    for header in headers:
+        prev = byexpt.get(header.experiment_id, None)
+        if (prev is None or (header.printed_date or datetime.min) >=
+                            (prev.printed_date or datetime.min)):
+            byexpt[header.experiment_id] = header
+    if len(byexpt) == 0:
+        return counts
+    propids = set(h.proposal_id for h in byexpt.values())
+    proposals = set(row.id for row in beamdb.get_rows_in('proposal', 'id', propids))
+    experiments = {row.id: row for row in
+                   beamdb.get_rows_in('experiment', 'id', byexpt.keys())}
+    updates = []
+    for expt_id, header in byexpt.items():
+        if header.proposal_id not in proposals:
+            outcome = 'unknown_proposal'
+        elif expt_id not in experiments:
+            outcome = 'unknown_experiment'
+        else:
+            expt = experiments[expt_id]
+            vals = {'proposal_id': header.proposal_id,
+                    'beamline_id': match_beamline(header.beamline),
+                    'run_id': run_id}
+            if all(getattr(expt, key) == val for key, val in vals.items()):
+                outcome = 'skipped'
+            else:
+                outcome = 'updated'
+                vals['id'] = expt_id
+                updates.append(vals)
+        outcomes[expt_id] = outcome
+        if outcome != 'updated':
+            counts[outcome] += 1
+    if len(updates) > 0:
+        with beamdb.transaction():
+            beamdb.update_many('experiment', updates, key='id')
+    counts['updated'] = len(updates)
+    return counts
+
+def run_name_id(beamdb, run=None):
+    "(name, id) of a run, given by name, or the current run"
     if run is None:
         run_id = beamdb.get_info('current_run_id')
-        run_name = beamdb.get_rows('run', where={'id': int(run_id)},
-                                   limit_one=True, none_if_empty=True)
-        run_name = run_name.name
+        row = beamdb.get_rows('run', where={'id': int(run_id)},
+                              limit_one=True, none_if_empty=True)
     else:
-        run_name = run
-        run = beamdb.get_rows('run', where={'name': run},
-                                   limit_one=True, none_if_empty=True)
-        run_id = run.id
-        
-    for bname in ('BMC', 'BMD',  'ID CD', 'IDE'):
-        folder = Path(esaf_folder, run_name, bname)
-        for pdffile in glob(folder.as_posix() + '/*'):
-            if not pdffile.endswith('.pdf'):
-                continue
-                
-            data = read_esaf_header(pdffile)
-            # print("READ PDF ", pdffile, '\n', data)
-            if data['beamline'] is None:
+        row = beamdb.get_rows('run', where={'name': run},
+                              limit_one=True, none_if_empty=True)
+    if row is None:
+        raise ValueError(f'unknown run {run}')
+    return row.name, row.id
+
+def ingest_esaf_pdfs(beamdb, files, run_name, run_id, workers=None, force=False):
+    """read a list of ESAF PDF files for a run, skipping files that are
+    unchanged in the esaf_pdf_manifest table (unless force=True), record
+    them in the manifest, and update their experiments.
+
+    Experiments of all manifest files for the run whose proposal or
+    experiment was not yet in the database (RETRY_OUTCOMES) are updated
+    again from their stored header values, whether or not they are in
+    `files`.
+
+    Returns dict of counts, as for read_esaf_pdfs().
+    """
+    add_esaf_pdf_manifest_table(beamdb)
+    counts = {'files': len(files), 'unchanged': 0, 'failed': 0, 'retried': 0}
+    manifest = {}
+    if not force:
+        manifest = {row.path: row for row in
+                    beamdb.get_rows_in('esaf_pdf_manifest', 'path', files)}
+
+    # stat all files, and hash those whose size or time changed
+    fileinfo, toparse, touched = {}, [], []
+    for pdffile in files:
+        try:
+            fstat = os.stat(pdffile)
+            row = manifest.get(pdffile, None)
+            if (row is not None and row.size == fstat.st_size and
+                row.mtime == fstat.st_mtime):
+                counts['unchanged'] += 1
                 continue
-            bl_id = match_beamline(data['beamline'])
-            proprow = beamdb.get_row('proposal', where={'id': int(data['proposal_id'])})
-            if proprow is not None:
-                beamdb.update('experiment', where={'id': int(data['experiment_id'])},
-                              proposal_id=int(data['proposal_id']), beamline_id=bl_id,
-                              run_id=run_id)
-
-              
+            fhash = file_hash(pdffile)
+        except OSError as exc:
+            print(f"could not read ESAF PDF {pdffile}: {exc}")
+            counts['failed'] += 1
+            continue
+        if row is not None and row.hash == fhash:
+            touched.append({'path': pdffile, 'size': fstat.st_size,
+                            'mtime': fstat.st_mtime})
+            counts['unchanged'] += 1
+            continue
+        fileinfo[pdffile] = (fstat.st_size, fstat.st_mtime, fhash)
+        toparse.append(pdffile)
+
+    manifest_rows, headers = [], []
+    for pdffile, header, error in iter_esaf_headers(toparse, workers=workers):
+        if error is None and header.beamline is not None:
+            missing = header.missing(REQUIRED_FIELDS)
+            if len(missing) > 0:
+                error = f"incomplete header: no {', '.join(missing)}"
+        manifest_rows.append(manifest_row(pdffile, run_name, *fileinfo[pdffile],
+                                          header, error))
+        if error is not None:
+            print(f"could not read ESAF PDF {pdffile}: {error}")
+            counts['failed'] += 1
+        elif header.beamline is not None:
+            headers.append((pdffile, header))
+
+    # files read earlier whose proposal or experiment was not known
+    parsed = set(row['path'] for row in manifest_rows)
+    retry = [row for row in beamdb.get_rows('esaf_pdf_manifest',
+                                            where={'run': run_name,
+                                                   'outcome': list(RETRY_OUTCOMES)})
+             if row.path not in parsed]
+    counts['retried'] = len(retry)
+    headers.extend((row.path, manifest_header(row)) for row in retry)
+    # files are parsed in any order: sort by path, so that the header used
+    # for an experiment with several files does not depend on that order
+    headers = [header for path, header in sorted(headers, key=lambda x: x[0])]
+
+    with beamdb.transaction():
+        outcomes = {}
+        counts.update(update_experiments(beamdb, headers, run_id,
+                                         outcomes=outcomes))
+        for row in manifest_rows:
+            if row['error'] is None:
+                row['outcome'] = outcomes.get(row['experiment_id'], None)
+        if len(manifest_rows) > 0:
+            beamdb.upsert_many('esaf_pdf_manifest', 'path', manifest_rows)
+        changes = {row['path']: row for row in touched}
+        for row in retry:
+            outcome = outcomes.get(row.experiment_id, None)
+            if outcome != row.outcome:
+                changes.setdefault(row.path, {'path': row.path})['outcome'] = outcome
+        if len(changes) > 0:
+            beamdb.update_many('esaf_pdf_manifest', list(changes.values()),
+                               key='path')
+    if len(files) == 0 and len(retry) == 0:
+        return counts
+    print(f"ESAF PDFs for run {run_name}: {counts['files']} files, "
+          f"{counts['unchanged']} unchanged, {counts['retried']} retried, "
+          f"{counts['updated']} experiments updated, "
+          f"{counts['skipped']} up to date, {counts['unknown_proposal']} unknown proposals, "
+          f"{counts['unknown_experiment']} unknown experiments, {counts['failed']} failed")
+    return counts
+
+def read_esaf_pdfs(run=None, workers=None, force=False, esaf_folder=None):
+    """read ESAF PDFs for a run (default: current run) from the
+    esaf_pdf_folder, and set proposal, beamline, and run for the
+    experiments they describe.
+
+    Arguments
+    ----------
+    run          run name [None, current run]
+    workers      number of processes parsing PDFs [None, parse in this process]
+                 0 for one per CPU.
+    force        whether to read all PDFs, not only new or changed ones [False]
+    esaf_folder  top folder of ESAF PDFs [None, info 'esaf_pdf_folder']
+
+    Each file read is recorded in the esaf_pdf_manifest table, with its
+    size, modification time, content hash, header values, and the outcome
+    of updating its experiment.  Later scans read only files that are new
+    or whose contents changed, and update again the experiments of files
+    whose proposal or experiment was not yet in the database.
+
+    PDFs are parsed in worker processes and written to the database
+    by this process.  Files that cannot be read are reported and skipped.
+
+    Experiments are updated together, see update_experiments().
+
+    Returns dict of counts of 'files', 'unchanged' (files not read again),
+    'failed' (files that could not be read), 'retried' (unchanged files
+    whose experiments are updated again), and the counts of experiments
+    from update_experiments(): 'updated', 'skipped', 'unknown_proposal',
+    and 'unknown_experiment'.
+    """
+    beamdb = get_beamline_names()
+    if esaf_folder is None:
+        esaf_folder = beamdb.get_info('esaf_pdf_folder')
+    run_name, run_id = run_name_id(beamdb, run)
+    files = esaf_pdf_files(esaf_folder, run_name)
+    return ingest_esaf_pdfs(beamdb, files, run_name, run_id, workers=workers,
+                            force=force)
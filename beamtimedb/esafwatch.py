@@ -0,0 +1,243 @@
+"""
+watch the ESAF PDF folders of a run for new or changed PDFs, and read
+each one into the beamtime database as soon as it is completely written:
+
+   watcher = ESAFWatcher(run='2025-1')
+   watcher.run()
+
+or, from the command line:
+
+   python scripts/read_esaf_pdfs.py --watch
+
+The beamline folders (PDF_FOLDERS) of the run are watched with inotify
+if the inotify_simple package is installed (Linux), and are also scanned
+every `poll_interval` seconds, as inotify does not see files written by
+other machines to a network file system.  A PDF is read once its size and
+modification time have not changed for `settle_time` seconds, so that
+partially written files are not read.  Only the new or changed files are
+read, using esafpdf.ingest_esaf_pdfs(), which also retries files whose
+proposal or experiment was not yet in the database.  That retry is also
+made every `retry_interval` seconds when no new files are read.
+"""
+import os
+import time
+import signal
+import logging
+import threading
+from pathlib import Path
+
+from .esafpdf import (PDF_FOLDERS, get_beamline_names, run_name_id,
+                      ingest_esaf_pdfs)
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+    HAS_INOTIFY = True
+except ImportError:
+    HAS_INOTIFY = False
+
+# seconds a PDF must be unchanged before it is read
+SETTLE_TIME = 2.0
+
+# seconds between folder scans
+POLL_INTERVAL = 5.0
+
+# seconds between retries of files with unknown proposal or experiment
+RETRY_INTERVAL = 300.0
+
+
+class ESAFWatcher(object):
+    """watch ESAF PDF folders of a run, reading new or changed PDFs
+
+    Arguments
+    ----------
+    run            run name [None, current run]
+    esaf_folder    top folder of ESAF PDFs [None, info 'esaf_pdf_folder']
+    settle_time    seconds a file must be unchanged before it is read [SETTLE_TIME]
+    poll_interval  seconds between folder scans [POLL_INTERVAL]
+    retry_interval seconds between retries of files with unknown proposal
+                   or experiment [RETRY_INTERVAL]
+    use_inotify    whether to use inotify [None, use if available]
+    initial_scan   whether to read new or changed PDFs at start [True]
+    """
+    def __init__(self, run=None, esaf_folder=None, settle_time=SETTLE_TIME,
+                 poll_interval=POLL_INTERVAL, retry_interval=RETRY_INTERVAL,
+                 use_inotify=None, initial_scan=True):
+        self.beamdb = get_beamline_names()
+        if esaf_folder is None:
+            esaf_folder = self.beamdb.get_info('esaf_pdf_folder')
+        self.run_name, self.run_id = run_name_id(self.beamdb, run)
+        self.folders = [Path(esaf_folder, self.run_name, bname).as_posix()
+                        for bname in PDF_FOLDERS]
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        if use_inotify is None:
+            use_inotify = HAS_INOTIFY
+        self.use_inotify = use_inotify and HAS_INOTIFY
+        self.initial_scan = initial_scan
+        self.stop_event = threading.Event()
+        # path: (size, mtime, time first seen with that size and mtime)
+        self.pending = {}
+        # path: (size, mtime) of files read
+        self.seen = {}
+        # path: (size, mtime) of settled files being read
+        self.reading = {}
+        self.counts = {}
+        self.errors = 0
+        self.last_error = None
+        self.inotify = None
+        self.watches = {}
+        self.last_watch_check = 0
+        self.last_scan = 0
+        self.last_ingest = 0
+
+    def _add_pending(self, path):
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        key = (fstat.st_size, fstat.st_mtime)
+        if self.pending.get(path, (None, None, None))[:2] != key:
+            self.pending[path] = (*key, time.monotonic())
+
+    def scan_folders(self):
+        """stat PDFs in the watched folders, adding new or changed
+        files to the pending files"""
+        self.last_scan = time.monotonic()
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith('.pdf'):
+                    continue
+                try:
+                    fstat = entry.stat()
+                except OSError:
+                    continue
+                key = (fstat.st_size, fstat.st_mtime)
+                if self.seen.get(entry.path, None) != key:
+                    self._add_pending(entry.path)
+
+    def _add_watches(self, scan=True):
+        """add inotify watches for folders, including folders created later,
+        and with scan=True add PDFs already in newly watched folders"""
+        self.last_watch_check = time.monotonic()
+        mask = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+        for folder in self.folders:
+            if folder not in self.watches.values() and os.path.isdir(folder):
+                self.watches[self.inotify.add_watch(folder, mask)] = folder
+                if scan:
+                    for entry in os.scandir(folder):
+                        if entry.name.endswith('.pdf'):
+                            self._add_pending(entry.path)
+
+    def _read_events(self, timeout):
+        for event in self.inotify.read(timeout=int(timeout*1000)):
+            folder = self.watches.get(event.wd, None)
+            if folder is not None and event.name.endswith('.pdf'):
+                self._add_pending(os.path.join(folder, event.name))
+
+    def ready_files(self):
+        """list of pending files that have settled, moving them
+        from the pending files to the files being read"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime, tfirst) in list(self.pending.items()):
+            self._add_pending(path)
+            if path not in self.pending:
+                continue
+            if (self.pending[path][2] == tfirst and
+                now - tfirst >= self.settle_time):
+                ready.append(path)
+                self.reading[path] = (size, mtime)
+                self.pending.pop(path)
+        return sorted(ready)
+
+    def ingest(self, files):
+        """read a list of ESAF PDFs into the database, returning counts.
+        If this fails, the files are put back in the pending files."""
+        self.last_ingest = time.monotonic()
+        try:
+            counts = ingest_esaf_pdfs(self.beamdb, files, self.run_name,
+                                      self.run_id)
+        except Exception:
+            now = time.monotonic()
+            for path in files:
+                key = self.reading.pop(path, None)
+                self.seen.pop(path, None)
+                if key is not None:
+                    self.pending[path] = (*key, now)
+            raise
+        for path in files:
+            key = self.reading.pop(path, None)
+            if key is not None:
+                self.seen[path] = key
+        for key, val in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + val
+        return counts
+
+    def check(self, timeout=None):
+        """wait up to timeout seconds for changed files, and read any
+        settled PDFs.  Returns counts, or None if no files were read."""
+        if timeout is None:
+            timeout = self.settle_time/2.0 if self.pending else self.poll_interval
+        if self.inotify is not None:
+            self._read_events(timeout)
+            if (len(self.watches) < len(self.folders) and
+                time.monotonic() - self.last_watch_check > self.poll_interval):
+                self._add_watches()
+        else:
+            self.stop_event.wait(timeout)
+        if time.monotonic() - self.last_scan >= self.poll_interval:
+            self.scan_folders()
+        files = self.ready_files()
+        if (len(files) > 0 or
+            time.monotonic() - self.last_ingest >= self.retry_interval):
+            return self.ingest(files)
+        return None
+
+    def stop(self, *args):
+        "stop run()"
+        self.stop_event.set()
+
+    def run(self):
+        """watch folders until stop() is called (or SIGINT/SIGTERM is
+        received, when run in the main thread)"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        self.stop_event.clear()
+        if self.use_inotify:
+            self.inotify = INotify()
+            self._add_watches(scan=False)
+        # files found at start are read once settled, as for new files
+        self.scan_folders()
+        if self.initial_scan:
+            if len(self.pending) == 0:
+                # retry files with unknown proposal or experiment now
+                self.last_ingest = time.monotonic() - self.retry_interval
+        else:
+            for path, (size, mtime, tfirst) in self.pending.items():
+                self.seen[path] = (size, mtime)
+            self.pending = {}
+            self.last_ingest = time.monotonic()
+        mode = 'inotify' if self.inotify is not None else 'polling'
+        print(f"watching ESAF PDF folders for run {self.run_name} ({mode})")
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.check()
+                except Exception as exc:
+                    # for example, lost database connection: files are
+                    # read again on the next try
+                    logging.exception('reading ESAF PDFs failed')
+                    self.errors += 1
+                    self.last_error = f'{exc.__class__.__name__}: {exc}'
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+                self.inotify = None
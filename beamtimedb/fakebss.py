@@ -0,0 +1,223 @@
+"""
+In-process stand-in for the APS BSS Server (apsbss.server_interface.Server),
+generating configurable numbers of ESAFs, proposals, and users, so that
+filldb_from_apsbss and update_pvs can be run and benchmarked without
+a connection to the APS BSS/DM service:
+
+   from beamtimedb import BeamtimeDB, filldb_from_apsbss
+   from beamtimedb.fakebss import FakeBSSServer
+
+   bss = FakeBSSServer(n_esafs=200, n_users=800, seed=1)
+   filldb_from_apsbss(bt_db=BeamtimeDB(), bss_server=bss)
+
+The generated data is deterministic for a given seed.
+"""
+import time
+import random
+from datetime import datetime, timedelta
+from pytz import timezone
+
+from .use_apsbss import BEAMLINES
+
+TZONE = timezone('America/Chicago')
+
+LAST_NAMES = ('Smith', 'Garcia', 'Chen', 'Nguyen', 'Kowalski', 'Okafor',
+              'Ivanova', 'Tanaka', 'Muller', 'Rossi', 'Dubois', 'Silva',
+              'Patel', 'Kim', 'Haddad', 'Larsen', 'Novak', 'Moreau')
+
+FIRST_NAMES = ('Alex', 'Maria', 'Wei', 'Linh', 'Piotr', 'Ada', 'Olga',
+               'Yuki', 'Hans', 'Giulia', 'Camille', 'Joao', 'Priya',
+               'Min', 'Omar', 'Freya', 'Jan', 'Lea')
+
+ESAF_STATUS = ('Approved', 'Approved', 'Approved', 'Pending',
+               'Conditional Approval')
+
+
+class FakeUser(object):
+    "ESAF user, as apsbss ESAF users"
+    def __init__(self, badge, firstName, lastName, email, institution,
+                 is_pi=False):
+        self.badge = str(badge)
+        self.firstName = firstName
+        self.lastName = lastName
+        self.email = email
+        self.institution = institution
+        self.is_pi = is_pi
+
+    def __repr__(self):
+        return f"FakeUser({self.badge}, {self.firstName} {self.lastName})"
+
+
+class FakeESAF(object):
+    "ESAF, as from apsbss Server.esafs()"
+    def __init__(self, esaf_id, sector, run, status, title, description,
+                 startDate, endDate, users):
+        self.esaf_id = esaf_id
+        self.sector = sector
+        self.run = run
+        self.status = status
+        self.title = title
+        self.description = description
+        self.startDate = startDate
+        self.endDate = endDate
+        self._users = users
+
+    def __repr__(self):
+        return f"FakeESAF({self.esaf_id}, run={self.run})"
+
+
+class FakeProposal(object):
+    "proposal, as from apsbss Server.proposals()"
+    def __init__(self, proposal_id, beamline, run, title, startDate, endDate,
+                 users):
+        self.proposal_id = proposal_id
+        self.beamline = beamline
+        self.run = run
+        self.title = title
+        self.startDate = startDate
+        self.endDate = endDate
+        self._users = users
+
+    @property
+    def badges(self):
+        return [u.badge for u in self._users]
+
+    @property
+    def lastNames(self):
+        return [u.lastName for u in self._users]
+
+    def to_dict(self):
+        exps = []
+        for u in self._users:
+            exps.append({'badge': u.badge, 'firstName': u.firstName,
+                         'lastName': u.lastName, 'email': u.email,
+                         'institution': u.institution,
+                         'piFlag': 'Y' if u.is_pi else 'N'})
+        return {'id': self.proposal_id, 'title': self.title,
+                'startTime': self.startDate, 'endTime': self.endDate,
+                'experimenters': exps}
+
+    def __repr__(self):
+        return f"FakeProposal({self.proposal_id}, {self.beamline})"
+
+
+class FakeBSSServer(object):
+    """stand-in for apsbss.server_interface.Server
+
+    Arguments
+    ----------
+    sector                 sector name ['13']
+    runs                   run names, the last being the current run
+    n_esafs                number of ESAFs per run [100]
+    n_proposals            number of proposals per beamline per run [20]
+    n_users                number of distinct users [400]
+    n_institutions         number of distinct institutions [40]
+    users_per_esaf         number of users on each ESAF [4]
+    users_per_proposal     number of experimenters on each proposal [5]
+    latency                seconds of delay added to each request [0]
+    seed                   random seed [0]
+
+    The current run spans the current time, so that update_pvs finds
+    current ESAFs and proposals.  `requests` counts calls to each method.
+    """
+    def __init__(self, sector='13', runs=('2024-3', '2025-1'), n_esafs=100,
+                 n_proposals=20, n_users=400, n_institutions=40,
+                 users_per_esaf=4, users_per_proposal=5, latency=0.0, seed=0):
+        self.sector = sector
+        self.runs = list(runs)
+        self.latency = latency
+        self.requests = {}
+        rand = random.Random(seed)
+
+        insts = [f'University {i:03d}' for i in range(max(1, n_institutions))]
+        self.users = []
+        for i in range(max(1, n_users)):
+            first, last = rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)
+            self.users.append((100000 + i, first, f'{last}{i:d}',
+                               f'{first.lower()}.{last.lower()}{i}@example.edu',
+                               rand.choice(insts)))
+
+        beamlines = list(BEAMLINES[sector].values())
+        now = datetime.now().astimezone(TZONE)
+        self._esafs, self._proposals = {}, {}
+        for irun, run in enumerate(self.runs):
+            run_start = now - timedelta(days=60*(len(self.runs) - irun))
+            self._esafs[run] = []
+            self._proposals[run] = {bl: {} for bl in beamlines}
+            slots = max(1, n_proposals)
+            for ibl, bl in enumerate(beamlines):
+                for i in range(n_proposals):
+                    start = run_start + timedelta(days=120*i/slots)
+                    users = self._pick_users(rand, users_per_proposal)
+                    propid = 80000 + 10000*irun + 1000*ibl + i
+                    self._proposals[run][bl][propid] = FakeProposal(
+                        propid, bl, run, f'Proposal {propid} on {bl}\n',
+                        start, start + timedelta(days=120/slots), users)
+            for i in range(n_esafs):
+                bl = beamlines[i % len(beamlines)]
+                props = list(self._proposals[run][bl].values())
+                if len(props) > 0:
+                    prop = props[(i // len(beamlines)) % len(props)]
+                    start, end = prop.startDate, prop.endDate
+                    users = self._pick_users(rand, users_per_esaf,
+                                             pool=prop._users)
+                else:
+                    start = run_start + timedelta(days=rand.uniform(0, 110))
+                    end = start + timedelta(days=2)
+                    users = self._pick_users(rand, users_per_esaf)
+                esaf_id = 250000 + 10000*irun + i
+                self._esafs[run].append(FakeESAF(esaf_id, sector, run,
+                                    rand.choice(ESAF_STATUS),
+                                    f'Experiment {esaf_id} on {bl}',
+                                    f'Description of experiment {esaf_id}',
+                                    start, end, users))
+
+    def _pick_users(self, rand, nusers, pool=None):
+        "pick users, the first one being PI"
+        users = []
+        if pool is not None:
+            pool = [(int(u.badge), u.firstName, u.lastName, u.email,
+                     u.institution) for u in pool]
+            pool = pool[:nusers]
+        else:
+            pool = rand.sample(self.users, min(nusers, len(self.users)))
+        for i, (badge, first, last, email, inst) in enumerate(pool):
+            users.append(FakeUser(badge, first, last, email, inst, is_pi=(i==0)))
+        return users
+
+    def _request(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @property
+    def current_run(self):
+        return self.runs[-1]
+
+    def esafs(self, sector, run=None):
+        "all ESAFs for a sector and run"
+        self._request('esafs')
+        if run is None:
+            run = self.current_run
+        if sector != self.sector:
+            return []
+        return list(self._esafs.get(run, []))
+
+    def current_esafs(self, sector):
+        "ESAFs for a sector for the current run"
+        self._request('current_esafs')
+        if sector != self.sector:
+            return []
+        return list(self._esafs[self.current_run])
+
+    def proposals(self, beamline, run=None):
+        "dict of proposals for a beamline and run"
+        self._request('proposals')
+        if run is None:
+            run = self.current_run
+        return dict(self._proposals.get(run, {}).get(beamline, {}))
+
+    def current_proposals(self, beamline):
+        "dict of proposals for a beamline for the current run"
+        self._request('current_proposals')
+        return dict(self._proposals[self.current_run].get(beamline, {}))
@@ -0,0 +1,122 @@
+"""
+match ESAFs to proposals (and so to beamlines) by their users.
+
+A ProposalMatcher indexes each proposal by user badge and by normalized
+user last name once, and then scores each ESAF against only those
+proposals sharing a badge or last name with it:
+
+   matcher = ProposalMatcher()
+   for prefix, prop in current_proposals.items():
+       matcher.add(prefix, prop.badges, prop.lastNames)
+
+   match = matcher.best([u.badge for u in esaf._users],
+                        [u.lastName for u in esaf._users])
+   if match is not None:
+       print(match.key, match.confidence)
+
+Users are matched by badge first. Users without a matching badge are
+matched by last name, which counts for NAME_WEIGHT of a badge match.
+The confidence of a match is the weighted fraction of ESAF users
+matched, from 0 to 1.
+"""
+import unicodedata
+from collections import namedtuple
+
+# weight of a last-name-only match of a user, relative to a badge match
+NAME_WEIGHT = 0.5
+
+Match = namedtuple('Match', ('key', 'confidence', 'badges', 'names'))
+
+
+def normalize_name(name):
+    "normalize a name for matching: lower case, no accents or extra spaces"
+    if name is None:
+        return ''
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.lower().split())
+
+
+def normalize_badge(badge):
+    "normalize a badge number for matching"
+    if badge is None:
+        return ''
+    return str(badge).strip().lstrip('0')
+
+
+class ProposalMatcher(object):
+    """index of proposals by user badge and last name, for matching ESAFs
+    to proposals
+
+    Arguments
+    ----------
+    name_weight  weight of a last-name-only user match [NAME_WEIGHT]
+    """
+    def __init__(self, name_weight=NAME_WEIGHT):
+        self.name_weight = name_weight
+        self.keys = []
+        self.by_badge = {}
+        self.by_name = {}
+
+    def add(self, key, badges, last_names):
+        """add a proposal to the index
+
+        Arguments
+        ----------
+        key          key to return for matches (proposal id, PV prefix, ...)
+        badges       list of badges of proposal users
+        last_names   list of last names of proposal users
+        """
+        self.keys.append(key)
+        for badge in badges:
+            badge = normalize_badge(badge)
+            if len(badge) > 0:
+                self.by_badge.setdefault(badge, set()).add(key)
+        for name in last_names:
+            name = normalize_name(name)
+            if len(name) > 0:
+                self.by_name.setdefault(name, set()).add(key)
+
+    def match(self, badges, last_names):
+        """return list of Matches of proposals for the users of an ESAF,
+        ordered by decreasing confidence
+
+        Arguments
+        ----------
+        badges       list of badges of ESAF users
+        last_names   list of last names of ESAF users, in the same order
+
+        Each Match has 'key', 'confidence' (0 to 1), and the numbers of
+        users matched by 'badges' and by 'names' only.
+        """
+        nusers = max(len(badges), len(last_names))
+        if nusers == 0:
+            return []
+        badges = list(badges) + [None]*(nusers - len(badges))
+        last_names = list(last_names) + [None]*(nusers - len(last_names))
+        nbadge, nname = {}, {}
+        for badge, name in zip(badges, last_names):
+            bkeys = self.by_badge.get(normalize_badge(badge), set())
+            for key in bkeys:
+                nbadge[key] = nbadge.get(key, 0) + 1
+            for key in self.by_name.get(normalize_name(name), set()):
+                if key not in bkeys:
+                    nname[key] = nname.get(key, 0) + 1
+
+        out = []
+        for key in self.keys:
+            nb, nn = nbadge.get(key, 0), nname.get(key, 0)
+            if nb + nn > 0:
+                conf = (nb + self.name_weight*nn)/nusers
+                out.append(Match(key, conf, nb, nn))
+        out.sort(key=lambda m: (-m.confidence, -m.badges))
+        return out
+
+    def best(self, badges, last_names, min_confidence=0.0):
+        """return best Match of proposals for the users of an ESAF,
+        or None if no proposal matches with more than min_confidence
+        """
+        matches = self.match(badges, last_names)
+        if len(matches) > 0 and matches[0].confidence > min_confidence:
+            return matches[0]
+        return None
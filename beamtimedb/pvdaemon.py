@@ -0,0 +1,220 @@
+"""
+long-running updater of the beamline proposal and ESAF PVs.
+
+Instead of running update_pvs() from cron, which reconnects to the
+database and the APS BSS and re-creates all PVs each time, a PVUpdater
+keeps these connected and refreshes the PVs on a schedule:
+
+   beamtime_pvdaemon --sector 13 --interval 300 --status-prefix 13bss:
+
+Failed updates (APS BSS errors, timeouts) are retried after a delay that
+doubles with each consecutive failure, up to max_backoff seconds, and the
+APS BSS connection is re-made before the next try.
+
+If status_prefix is given, these PVs are written after each cycle:
+
+   {status_prefix}heartbeat     number of update cycles
+   {status_prefix}cycleTime     seconds taken by the last cycle
+   {status_prefix}lastUpdate    time of the last successful update
+   {status_prefix}status        'OK' or the last error message
+
+and if status_file is given, the status() dict is written to it as JSON.
+"""
+import json
+import time
+import signal
+import logging
+import threading
+from argparse import ArgumentParser
+from datetime import datetime
+
+from .beamtimedb import BeamtimeDB
+from .use_apsbss import (connect_bss, update_pvs, PVWriter,
+                         BSS_FETCH_TIMEOUT)
+
+# seconds between updates
+UPDATE_INTERVAL = 300
+
+# seconds to wait after the first failed update, and longest wait
+RETRY_DELAY = 30
+MAX_BACKOFF = 1800
+
+
+class PVUpdater(object):
+    """update beamline proposal and ESAF PVs on a schedule, keeping the
+    database, APS BSS, and PV connections between updates
+
+    Arguments
+    ----------
+    sector         sector name ['13']
+    interval       seconds between updates [UPDATE_INTERVAL]
+    retry_delay    seconds to wait after a first failed update [RETRY_DELAY]
+    max_backoff    longest wait after failed updates [MAX_BACKOFF]
+    status_prefix  prefix for status PVs [None, no status PVs]
+    status_file    file name for JSON status record [None]
+    workers        number of concurrent APS BSS requests
+    timeout        seconds to wait for APS BSS requests
+    bt_db          BeamtimeDB [None, connect with default settings]
+    bss_server     APS BSS Server [None, connect using bt_db]
+    """
+    def __init__(self, sector='13', interval=UPDATE_INTERVAL,
+                 retry_delay=RETRY_DELAY, max_backoff=MAX_BACKOFF,
+                 status_prefix=None, status_file=None, workers=None,
+                 timeout=BSS_FETCH_TIMEOUT, bt_db=None, bss_server=None):
+        self.sector = sector
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+        self.status_prefix = status_prefix
+        self.status_file = status_file
+        self.workers = workers
+        self.timeout = timeout
+        self.bt_db = bt_db
+        self.bss_server = bss_server
+        self.reconnect_bss = bss_server is None
+        self.pv_writer = PVWriter()
+        # status PVs use their own writer, not counted in 'pv_puts'
+        self.status_writer = PVWriter()
+        self.stop_event = threading.Event()
+        self.cycles = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_cycle_time = 0.0
+        self.last_update = None
+        self.last_error = None
+        self.last_counts = {}
+
+    def connect(self):
+        "connect to database and APS BSS, if not already connected"
+        if self.bss_server is None:
+            if self.bt_db is None:
+                self.bt_db = BeamtimeDB(tables=['info'])
+            self.bss_server = connect_bss(self.bt_db)
+
+    def cycle(self):
+        """run one update: returns True on success, False on failure"""
+        t0 = time.monotonic()
+        ok = False
+        try:
+            self.connect()
+            self.last_counts = update_pvs(sector=self.sector,
+                                          workers=self.workers,
+                                          timeout=self.timeout,
+                                          bss_server=self.bss_server,
+                                          pv_writer=self.pv_writer)
+            ok = True
+            self.last_update = datetime.now()
+            self.last_error = None
+            self.consecutive_errors = 0
+        except Exception as exc:
+            logging.exception('PV update failed')
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = f'{exc.__class__.__name__}: {exc}'
+            # do not send values queued by the failed update
+            self.pv_writer.pending.clear()
+            # reconnect to the APS BSS for the next try
+            if self.reconnect_bss:
+                self.bss_server = None
+        self.cycles += 1
+        self.last_cycle_time = time.monotonic() - t0
+        self.write_status()
+        return ok
+
+    def next_delay(self):
+        "seconds to wait before the next update"
+        if self.consecutive_errors == 0:
+            return self.interval
+        delay = self.retry_delay * 2**(self.consecutive_errors-1)
+        return min(delay, self.max_backoff)
+
+    def status(self):
+        "dict of status of updates"
+        last_update = None
+        if self.last_update is not None:
+            last_update = self.last_update.isoformat(sep=' ', timespec='seconds')
+        return {'sector': self.sector, 'cycles': self.cycles,
+                'errors': self.errors,
+                'consecutive_errors': self.consecutive_errors,
+                'last_cycle_time': round(self.last_cycle_time, 3),
+                'last_update': last_update,
+                'last_error': self.last_error,
+                'next_delay': self.next_delay(),
+                'pv_puts': dict(self.pv_writer.counts),
+                'last_pv_puts': dict(self.last_counts)}
+
+    def write_status(self):
+        "write status PVs and status file"
+        status = self.status()
+        if self.status_prefix is not None:
+            put = self.status_writer.put
+            put(f'{self.status_prefix}heartbeat', self.cycles)
+            put(f'{self.status_prefix}cycleTime', status['last_cycle_time'])
+            put(f'{self.status_prefix}lastUpdate', status['last_update'] or '')
+            put(f'{self.status_prefix}status', self.last_error or 'OK')
+            self.status_writer.flush()
+        if self.status_file is not None:
+            try:
+                with open(self.status_file, 'w') as fh:
+                    json.dump(status, fh, indent=1)
+            except OSError:
+                logging.exception(f'could not write status file {self.status_file}')
+
+    def stop(self, *args):
+        "stop run() after the current update"
+        self.stop_event.set()
+
+    def run(self, max_cycles=None):
+        """run updates until stop() is called (or SIGINT/SIGTERM is
+        received, when run in the main thread), or for max_cycles"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        self.stop_event.clear()
+        ncycles = 0
+        while not self.stop_event.is_set():
+            self.cycle()
+            ncycles += 1
+            if max_cycles is not None and ncycles >= max_cycles:
+                break
+            self.stop_event.wait(self.next_delay())
+
+
+def main():
+    "command-line entry point for the PV update daemon"
+    parser = ArgumentParser(description='update beamline proposal and ESAF PVs from APS BSS')
+    parser.add_argument('--sector', default='13')
+    parser.add_argument('--interval', type=float, default=UPDATE_INTERVAL,
+                        help='seconds between updates')
+    parser.add_argument('--retry-delay', type=float, default=RETRY_DELAY,
+                        help='seconds to wait after a first failed update')
+    parser.add_argument('--max-backoff', type=float, default=MAX_BACKOFF,
+                        help='longest wait after failed updates')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of concurrent APS BSS requests')
+    parser.add_argument('--timeout', type=float, default=BSS_FETCH_TIMEOUT,
+                        help='seconds to wait for APS BSS requests')
+    parser.add_argument('--status-prefix', default=None,
+                        help='prefix for heartbeat and status PVs')
+    parser.add_argument('--status-file', default=None,
+                        help='file to write JSON status to')
+    parser.add_argument('--fake', action='store_true',
+                        help='use generated data from FakeBSSServer')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    bss = None
+    if args.fake:
+        from .fakebss import FakeBSSServer
+        bss = FakeBSSServer(sector=args.sector)
+    updater = PVUpdater(sector=args.sector, interval=args.interval,
+                        retry_delay=args.retry_delay,
+                        max_backoff=args.max_backoff,
+                        workers=args.workers, timeout=args.timeout,
+                        status_prefix=args.status_prefix,
+                        status_file=args.status_file, bss_server=bss)
+    updater.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,8 +13,9 @@ create_beamtimedb('beamtime', server='postgresql', create=True,
 import time
 from datetime import datetime
 
-from sqlalchemy import (MetaData, create_engine, text, Table, Column,
-                        ForeignKey, Integer, Boolean, String, Text, DateTime)
+from sqlalchemy import (MetaData, create_engine, Table, Column,
+                        ForeignKey, Integer, BigInteger, Float, Boolean,
+                        String, Text, DateTime, Index, select, func)
 
 from sqlalchemy_utils import database_exists, create_database
 
@@ -38,13 +39,24 @@ FOLDER_STATUS = ('unknown', 'requested', 'pending', 'created', 'cancelled', 'del
 
 PROCESS_STATUS = ('new', 'processed', 'modified', 'completed', 'locked')
 
+# (table, column) with unique keys, so that SimpleDB.upsert() can use
+# native INSERT .. ON CONFLICT / ON DUPLICATE KEY UPDATE
+UNIQUE_COLUMNS = (('person', 'badge'), ('run', 'name'), ('beamline', 'name'),
+                  ('apsbss_beamline', 'name'), ('esaf_type', 'name'),
+                  ('esaf_status', 'name'), ('user_type', 'name'),
+                  ('user_level', 'name'), ('folder_status', 'name'),
+                  ('process_status', 'name'))
+
 def hasdb(dbname, create=False, server='postgresql',
              user='', password='', host='', port=5432):
     """
     return whether a database existsin the postgresql server,
     optionally creating (but leaving it empty) said database.
     """
-    conn_str= f'{server}://{user}:{password}@{host}:{int(port)}/{dbname}'
+    if server.startswith('sqlit'):
+        conn_str = f'sqlite:///{dbname}'
+    else:
+        conn_str = f'{server}://{user}:{password}@{host}:{int(port)}/{dbname}'
     engine = create_engine(conn_str)
     if create and not database_exists(engine.url):
         create_database(engine.url)
@@ -65,6 +77,77 @@ def PointerCol(name, other=None, keyid='id', **kws):
     return Column("%s_%s" % (name, keyid), None,
                   ForeignKey('%s.%s' % (other, keyid)), **kws)
 
+def sync_fingerprint_table(metadata):
+    """define table of content fingerprints of records synced from
+    the APS BSS, with kind 'esaf' or 'proposal' and the record id"""
+    return Table('sync_fingerprint', metadata,
+                 Column('kind', String(64), primary_key=True),
+                 Column('record_id', Integer, primary_key=True),
+                 Column('fingerprint', String(64)),
+                 Column('modify_time', DateTime, default=datetime.now))
+
+def add_sync_fingerprint_table(db):
+    """add the sync_fingerprint table to an existing database, if needed"""
+    if 'sync_fingerprint' not in db.tables:
+        sync_fingerprint_table(db.metadata).create(bind=db.engine, checkfirst=True)
+    return db.tables['sync_fingerprint']
+
+def add_unique_indexes(db):
+    """add unique indexes for UNIQUE_COLUMNS to an existing database
+    made before these columns were unique, if needed.
+
+    A column with duplicate values is reported and left without an index,
+    and upsert() falls back to select-then-insert for that table.
+
+    Returns list of names of indexes created.
+    """
+    created = []
+    for tname, colname in UNIQUE_COLUMNS:
+        if tname not in db.tables or db.has_unique_key(tname, (colname,)):
+            continue
+        tab = db.tables[tname]
+        col = tab.c[colname]
+        query = (select(col, func.count()).where(col.isnot(None))
+                 .group_by(col).having(func.count() > 1))
+        dups = db.execute(query).fetchall()
+        if len(dups) > 0:
+            print(f"cannot add unique index on {tname}.{colname}: "
+                  f"{len(dups)} duplicated values, such as {dups[0][0]}")
+            continue
+        index = Index(f'uq_{tname}_{colname}', col, unique=True)
+        index.create(bind=db.engine, checkfirst=True)
+        created.append(index.name)
+    if len(created) > 0:
+        db.clear_statement_cache()
+    return created
+
+def esaf_pdf_manifest_table(metadata):
+    """define table of ESAF PDF files read, with file size, modification
+    time, and content hash, the values read from the file header, and the
+    outcome of updating its experiment (see esafpdf.update_experiments)"""
+    return Table('esaf_pdf_manifest', metadata,
+                 Column('path', String(1024), primary_key=True),
+                 StrCol('run'),
+                 Column('size', BigInteger),
+                 Column('mtime', Float),
+                 Column('hash', String(64)),
+                 IntCol('experiment_id'),
+                 IntCol('proposal_id'),
+                 StrCol('beamline'),
+                 StrCol('experiment_type'),
+                 Column('start_date', DateTime),
+                 Column('end_date', DateTime),
+                 StrCol('spokesperson', size=256),
+                 Column('error', Text),
+                 StrCol('outcome', size=64),
+                 Column('modify_time', DateTime, default=datetime.now))
+
+def add_esaf_pdf_manifest_table(db):
+    """add the esaf_pdf_manifest table to an existing database, if needed"""
+    if 'esaf_pdf_manifest' not in db.tables:
+        esaf_pdf_manifest_table(db.metadata).create(bind=db.engine, checkfirst=True)
+    return db.tables['esaf_pdf_manifest']
+
 def create_beamtimedb(dbname, server='postgresql', create=True,
                       user='', password='',  host='', port=5432, **kws):
     """Create a BeamtimeDB:
@@ -75,7 +158,7 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
 
     options:
     --------
-    server    type of database server (postgresql only at the moment)
+    server    type of database server ('postgresql', or 'sqlite' for testing)
     host      host serving database
     port      port number for database
     user      user name for database
@@ -112,23 +195,27 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
 
     user_types = Table('user_type', metadata,
                        Column('id', Integer, primary_key=True),
-                       Column('name', String(64)))
+                       Column('name', String(64), unique=True))
     
     user_level = Table('user_level', metadata,
                        Column('id', Integer, primary_key=True),
-                       Column('name', String(64)))                       
+                       Column('name', String(64), unique=True))                       
 
     esaf_type = Table('esaf_type', metadata,
                        Column('id', Integer, primary_key=True),
-                       Column('name', String(64)))                       
+                       Column('name', String(64), unique=True))                       
                       
     esaf_status = Table('esaf_status', metadata,
                        Column('id', Integer, primary_key=True),
-                       Column('name', String(64)))                       
+                       Column('name', String(64), unique=True))                       
+
+    folder_status = Table('folder_status', metadata,
+                       Column('id', Integer, primary_key=True),
+                       Column('name', String(64), unique=True))
 
-    folder_status = Table('esaf_status', metadata,
+    process_status = Table('process_status', metadata,
                        Column('id', Integer, primary_key=True),
-                       Column('name', String(64)))                       
+                       Column('name', String(64), unique=True))
     
     insts = Table('institution', metadata,
                   Column('id', Integer, primary_key=True),
@@ -145,19 +232,23 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
 
     runs = Table('run', metadata,
                  Column('id', Integer, primary_key=True),
-                 Column('name', String(64)))                       
+                 Column('name', String(64), unique=True))                       
 
     beamlines = Table('beamline', metadata,
                  Column('id', Integer, primary_key=True),
-                 Column('name', String(64)))                       
+                 Column('name', String(64), unique=True))
+
+    apsbss_beamlines = Table('apsbss_beamline', metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('name', String(64), unique=True))
 
     technique = Table('technique', metadata,
                       Column('id', Integer, primary_key=True),
                       Column('name', String(512)),
                       Column('user_name', String(64)),
                       Column('base_dir', String(512)),                      
-                      Column('pvlog_template', text),
-                      PointerColumn('beamline'),
+                      Column('pvlog_template', Text),
+                      PointerCol('beamline'),
                       )
 
     acknow = Table('acknowledgment', metadata,
@@ -168,7 +259,7 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
 
     users = Table('person', metadata,
                   Column('id', Integer, primary_key=True),                  
-                  Column('badge', Integer),
+                  Column('badge', Integer, unique=True),
                   StrCol('first_name'),
                   StrCol('last_name'),
                   StrCol('email'),
@@ -244,6 +335,9 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
                          PointerCol('experiment'),
                          PointerCol('acknowledgment'))
 
+    sync_fprint = sync_fingerprint_table(metadata)
+    pdf_manifest = esaf_pdf_manifest_table(metadata)
+
     metadata.create_all(bind=engine)
     time.sleep(0.1)
 
@@ -257,9 +351,9 @@ def create_beamtimedb(dbname, server='postgresql', create=True,
                           ('user_type', USER_TYPES),
                           ('user_level', USER_LEVEL),
                           ('beamline', BEAMLINES),
+                          ('apsbss_beamline', BEAMLINES),
                           ):
-        for val in values:
-            db.insert(table, name=val)
+        db.insert_many(table, [{'name': val} for val in values])
 
     for key, value in (("version", "1.1"),
                        ("version", "1.2"),                       
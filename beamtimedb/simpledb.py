@@ -6,13 +6,39 @@ Simple database interface using SQLAlchemy 2.0
 import os
 import time
 import random
+import sys
+import heapq
+import pickle
+import hashlib
+import threading
 import logging
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
 from datetime import datetime
 
-from sqlalchemy import MetaData, create_engine, text, and_
+from sqlalchemy import (MetaData, create_engine, and_, true, bindparam,
+                        event, inspect, select, table, column, UniqueConstraint)
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool, NullPool, StaticPool
 from sqlalchemy.sql.sqltypes import INTEGER
 
+POOL_CLASSES = {'queue': QueuePool, 'null': NullPool, 'static': StaticPool}
+
+STMT_CACHE_SIZE = 1024
+
+# largest number of values in one SQL 'IN' list, for get_rows_in()
+MAX_IN_VALUES = 1000
+
+# number of slowest statements kept by QueryStats
+SLOW_STATEMENT_COUNT = 20
+
+# SQLAlchemy default max_overflow for a QueuePool
+QUEUE_POOL_MAX_OVERFLOW = 10
+
+POOL_OPTIONS = ('pool', 'pool_size', 'max_overflow', 'pool_timeout',
+                'pool_recycle', 'pool_pre_ping')
+
 def get_credentials(credfile=None, envvar='ESCAN_CREDENTIALS', ):
     """look up credentials either from `credfile` (if not None)
     or from a file held in the supplied environment variable
@@ -25,10 +51,19 @@ server: postgresql
 port:  5432
 user:  db_user_name
 password: db_user_password
+
+    and may also set connection pool options (see SimpleDB.connect):
+pool: queue
+pool_size: 5
+max_overflow: 10
+pool_timeout: 30
+pool_recycle: 3600
+pool_pre_ping: true
     """
     conn = {'dbname': 'escandb', 'server': 'postgresql',
             'host': 'localhost',  'port': 5432,
             'user': '', 'password': '_invalid_password_'}
+    conn.update({key: None for key in POOL_OPTIONS})
     if credfile is None:
         credfile = os.environ.get(envvar, None)
     if credfile is not None and os.path.exists(credfile):
@@ -49,11 +84,178 @@ password: db_user_password
                 conn[key] = val
     return conn
 
+def schema_cache_folder():
+    """default folder for cached database schema, from the environment
+    variable SIMPLEDB_SCHEMA_CACHE, or ~/.cache/beamtimedb/schema"""
+    folder = os.environ.get('SIMPLEDB_SCHEMA_CACHE', None)
+    if folder is None:
+        top = os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache'))
+        folder = os.path.join(top, 'beamtimedb', 'schema')
+    return os.path.expanduser(folder)
+
+class ReflectedTables(Mapping):
+    """read-only mapping of table name to Table, as for MetaData.tables,
+    but reflecting each table from the database the first time it is used.
+    """
+    def __init__(self, metadata, engine, names=None):
+        self.metadata = metadata
+        self.engine = engine
+        self._names = names
+
+    @property
+    def names(self):
+        "names of all tables in the database"
+        if self._names is None:
+            self._names = tuple(inspect(self.engine).get_table_names())
+        return self._names
+
+    def __getitem__(self, name):
+        tab = self.metadata.tables.get(name, None)
+        if tab is None:
+            if name not in self.names:
+                raise KeyError(name)
+            self.metadata.reflect(bind=self.engine, only=[name])
+            tab = self.metadata.tables[name]
+        return tab
+
+    def __contains__(self, name):
+        return name in self.metadata.tables or name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+def pool_engine_args(pool=None, pool_size=None, max_overflow=None,
+                     pool_timeout=None, pool_recycle=None, pool_pre_ping=None):
+    """convert connection pool options, possibly read as strings
+    from a credentials file, to keyword arguments for create_engine()
+
+    pool is one of 'queue', 'null', or 'static' (or a Pool class)
+    or None for the SQLAlchemy default for the database dialect.
+    """
+    kws = {}
+    if isinstance(pool, str):
+        pool = pool.strip().lower()
+        if pool.endswith('pool'):
+            pool = pool[:-4]
+        if pool not in POOL_CLASSES:
+            raise ValueError(f"unknown connection pool '{pool}'")
+        pool = POOL_CLASSES[pool]
+    if pool is not None:
+        kws['poolclass'] = pool
+    if pool_recycle not in (None, ''):
+        kws['pool_recycle'] = int(pool_recycle)
+    if pool_pre_ping not in (None, ''):
+        if isinstance(pool_pre_ping, str):
+            pool_pre_ping = pool_pre_ping.strip().lower() in ('1', 'true', 'yes', 'y')
+        kws['pool_pre_ping'] = bool(pool_pre_ping)
+    if pool not in (NullPool, StaticPool):
+        for key, val in (('pool_size', pool_size),
+                         ('max_overflow', max_overflow),
+                         ('pool_timeout', pool_timeout)):
+            if val not in (None, ''):
+                kws[key] = float(val) if key == 'pool_timeout' else int(val)
+    return kws
+
+def server_name(server):
+    "database server name, 'postgresql', 'mysql', or 'sqlite', for a server"
+    if server.startswith('post') or server.startswith('pg'):
+        return 'postgresql'
+    elif server.startswith('my'):
+        return 'mysql'
+    return 'sqlite'
+
+def connect_url(dbname, server='postgresql', user='', password='',
+                port=None, host='localhost', dialect=None):
+    """database URL and connect_args for create_engine()
+
+    server is 'postgresql', 'mysql', or 'sqlite', and dialect the
+    optional driver name ('psycopg2', 'asyncpg', 'aiosqlite', ...).
+    """
+    if port not in (None, 'None', ''):
+        try:
+            port = int(port)
+        except:
+            pass
+    connect_args = {}
+    server = server_name(server)
+    if server == 'postgresql':
+        if port is None:
+            port = 5432
+        connect_str= f'{user}:{password}@{host}:{port:d}/{dbname}'
+    elif server == 'mysql':
+        if port is None:
+            port = 3306
+        connect_str= f'{user}:{password}@{host}:{port:d}/{dbname}'
+    else:
+        connect_str = f'/{dbname}'
+        connect_args = {'check_same_thread': False}
+
+    if dialect is None:
+        connect_str = f'{server}://{connect_str}'
+    else:
+        connect_str = f'{server}+{dialect}://{connect_str}'
+    return connect_str, connect_args
+
 def isotime(dtime=None, sep=' '):
     if dtime is None:
         dtime = datetime.now()
     return datetime.isoformat(dtime, sep=sep, timespec='milliseconds')
 
+class QueryStats(object):
+    """statistics of SQL statements: counts, rows, and time, in total and
+    per public database method, and the slowest statements.
+
+    rows counts rows reported by the database for all statements, and
+    rows_written only those for statements other than SELECT."""
+    def __init__(self, slow_count=SLOW_STATEMENT_COUNT):
+        self.slow_count = slow_count
+        self.reset()
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+        self.rows_written = 0
+        self.time = 0.0
+        self.methods = {}
+        self._slowest = []
+        self._seq = 0
+
+    def record(self, method, statement, elapsed, rows):
+        self.statements += 1
+        self.time += elapsed
+        if rows > 0:
+            self.rows += rows
+            if statement.lstrip()[:6].upper() != 'SELECT':
+                self.rows_written += rows
+        mstats = self.methods.get(method, None)
+        if mstats is None:
+            mstats = self.methods[method] = {'statements': 0, 'rows': 0,
+                                             'time': 0.0, 'max_time': 0.0}
+        mstats['statements'] += 1
+        mstats['time'] += elapsed
+        mstats['max_time'] = max(elapsed, mstats['max_time'])
+        if rows > 0:
+            mstats['rows'] += rows
+        self._seq += 1
+        entry = (elapsed, self._seq, method, statement)
+        if len(self._slowest) < self.slow_count:
+            heapq.heappush(self._slowest, entry)
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def as_dict(self):
+        "statistics as a dict"
+        slowest = [{'time': t, 'method': m, 'statement': stmt}
+                   for t, seq, m, stmt in sorted(self._slowest, reverse=True)]
+        return {'statements': self.statements, 'rows': self.rows,
+                'rows_written': self.rows_written, 'time': self.time,
+                'methods': {k: dict(v) for k, v in self.methods.items()},
+                'slowest': slowest}
+
+
 class SimpleDB(object):
     """simple, common interface to Postgres/SQLite3 databases
 
@@ -75,60 +277,228 @@ class SimpleDB(object):
 
     """
     def __init__(self, dbname=None, server='postgresql', user='',
-                 password='',  host='', port=5432, dialect=None, logfile=None):
+                 password='',  host='', port=5432, dialect=None, logfile=None,
+                 pool=None, pool_size=None, max_overflow=None,
+                 pool_timeout=None, pool_recycle=None, pool_pre_ping=None,
+                 tables=None, schema_cache=None, info_cache_ttl=None,
+                 instrument=False):
         self.engine = None
         self.metadata = None
         self.logfile = logfile
+        # open transaction (session) of each thread, see transaction()
+        self._local = threading.local()
+        self._pool_counts = {}
+        self._stmt_cache = {}
+        self._stmt_cache_stats = {'hits': 0, 'misses': 0}
+        self._where_colnames = {}
+        self._unique_keys = {}
+        self.info_cache_ttl = None
+        if info_cache_ttl not in (None, ''):
+            self.info_cache_ttl = float(info_cache_ttl)
+        self._info_cache = None
+        self._info_cache_time = 0
+        self._stats = None
+        self._stats_captures = []
+        self._stats_lock = threading.Lock()
         if dbname is not None:
             self.connect(dbname, server=server, user=user,
-                         password=password, port=port, host=host, dialect=dialect)
+                         password=password, port=port, host=host, dialect=dialect,
+                         pool=pool, pool_size=pool_size, max_overflow=max_overflow,
+                         pool_timeout=pool_timeout, pool_recycle=pool_recycle,
+                         pool_pre_ping=pool_pre_ping, tables=tables,
+                         schema_cache=schema_cache)
+            if instrument:
+                self.enable_stats()
 
     def connect(self, dbname, server='postgresql', user='',
-                password='', port=None, host='localhost', dialect=None):
-        "connect to an existing database"
+                password='', port=None, host='localhost', dialect=None,
+                pool=None, pool_size=None, max_overflow=None,
+                pool_timeout=None, pool_recycle=None, pool_pre_ping=None,
+                tables=None, schema_cache=None):
+        """connect to an existing database
 
-        self.dbname = dbname
-        if port not in (None, 'None', ''):
-            try:
-                port = int(port)
-            except:
-                pass
-        connect_args = {}
-        if server.startswith('post') or server.startswith('pg'):
-            server ='postgresql'
-            if port is None:
-                port = 5432
-            connect_str= f'{user}:{password}@{host}:{port:d}/{dbname}'
-        elif server.startswith('my'):
-            server = 'mysql'
-            if port is None:
-                port = 3306
-            connect_str= f'{user}:{password}@{host}:{port:d}/{dbname}'
-        else:
-            server = 'sqlite'
-            connect_str = f'/{dbname}'
-            connect_args = {'check_same_thread': False}
+        Schema reflection options:
 
-        if dialect is None:
-            connect_str = f'{server}://{connect_str}'
-        else:
-            connect_str = f'{server}+{dialect}://{connect_str}'
+        tables         None to reflect all tables at connection, or list of
+                       names of tables to reflect at connection, with all
+                       other tables reflected when first used.
+        schema_cache   None/False for no cache, True to use the default cache
+                       folder (see schema_cache_folder()), or name of folder.
+                       The reflected schema is saved to and read from a file
+                       keyed by database URL and the info table 'version',
+                       so that later connections skip reflection.
 
-        self.engine = create_engine(connect_str, connect_args=connect_args)
+        Connection pool options (all default to the SQLAlchemy defaults):
+
+        pool           'queue', 'null' (no pooling), or 'static' (one shared
+                       connection), or a sqlalchemy.pool class
+        pool_size      number of connections kept open in a queue pool
+        max_overflow   connections allowed beyond pool_size
+        pool_timeout   seconds to wait for a connection from a full pool
+        pool_recycle   seconds after which connections are replaced
+        pool_pre_ping  whether to test connections on checkout, to recover
+                       from stale connections after a database restart
+        """
+
+        self.dbname = dbname
+        connect_str, connect_args = connect_url(dbname, server=server,
+                                                user=user, password=password,
+                                                port=port, host=host,
+                                                dialect=dialect)
+
+        pool_kws = pool_engine_args(pool=pool, pool_size=pool_size,
+                                    max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout,
+                                    pool_recycle=pool_recycle,
+                                    pool_pre_ping=pool_pre_ping)
+        self.engine = create_engine(connect_str, connect_args=connect_args,
+                                    **pool_kws)
+        self._pool_counts = {'connects': 0, 'checkouts': 0, 'checkins': 0,
+                             'invalidated': 0, 'saturated': 0,
+                             'peak_checked_out': 0}
+        # most connections a queue pool will hand out, or None for no limit
+        self._pool_limit = None
+        if isinstance(self.engine.pool, QueuePool):
+            max_overflow = pool_kws.get('max_overflow', QUEUE_POOL_MAX_OVERFLOW)
+            if max_overflow >= 0:
+                self._pool_limit = self.engine.pool.size() + max_overflow
+        event.listen(self.engine, 'connect', self._on_pool_connect)
+        event.listen(self.engine, 'checkout', self._on_pool_checkout)
+        event.listen(self.engine, 'checkin', self._on_pool_checkin)
+        event.listen(self.engine, 'invalidate', self._on_pool_invalidate)
         self.metadata = MetaData()
-        try:
-            self.metadata.reflect(bind=self.engine)
-        except:
-            raise ValueError(f'{dbname:s} is not a valid database')
+        table_names = None
+        cachefile = None
+        if schema_cache not in (None, False):
+            cachefile = self.schema_cachefile(schema_cache)
+        if cachefile is not None and os.path.exists(cachefile):
+            try:
+                with open(cachefile, 'rb') as fh:
+                    table_names, self.metadata = pickle.load(fh)
+            except Exception:
+                table_names, self.metadata = None, MetaData()
+
+        if table_names is None:
+            try:
+                if tables is None or cachefile is not None:
+                    self.metadata.reflect(bind=self.engine)
+                    table_names = tuple(self.metadata.tables.keys())
+                elif len(tables) > 0:
+                    self.metadata.reflect(bind=self.engine, only=list(tables))
+            except:
+                raise ValueError(f'{dbname:s} is not a valid database')
+            if cachefile is not None:
+                self.save_schema_cache(cachefile, table_names)
 
-        tables = self.tables = self.metadata.tables
+        self.tables = ReflectedTables(self.metadata, self.engine,
+                                      names=table_names)
+        self._stmt_cache = {}
+        self._where_colnames = {}
+        self._unique_keys = {}
 
-        if self.logfile is None and server.startswith('sqlit'):
+        if self.logfile is None and self.engine.dialect.name == 'sqlite':
             self.logfile = f"{self.dbname:s}.log"
             logging.basicConfig()
             logger = logging.getLogger('sqlalchemy.engine')
             logger.addHandler(logging.FileHandler(self.logfile))
 
+    def schema_cachefile(self, folder=True):
+        """name of schema cache file for the connected database, keyed by
+        database URL and info 'version', or None if there is no version"""
+        if folder in (None, True):
+            folder = schema_cache_folder()
+        # info table without reflection, with 'key' quoted as needed (MySQL)
+        info = table('info', column('key'), column('value'))
+        query = select(info.c.value).where(info.c.key=='version')
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query)
+                version = ','.join(str(row[0]) for row in rows)
+        except Exception:
+            return None
+        if len(version) == 0:
+            return None
+        url = self.engine.url.render_as_string(hide_password=True)
+        key = hashlib.sha1(f'{url}|{version}'.encode('utf-8')).hexdigest()
+        return os.path.join(folder, f'{key}.pkl')
+
+    def save_schema_cache(self, cachefile, table_names=None):
+        "save reflected metadata to schema cache file"
+        if table_names is None:
+            table_names = tuple(self.metadata.tables.keys())
+        try:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            tmpfile = f'{cachefile}.{os.getpid()}.tmp'
+            with open(tmpfile, 'wb') as fh:
+                pickle.dump((tuple(table_names), self.metadata), fh)
+            os.replace(tmpfile, cachefile)
+        except OSError:
+            logging.getLogger(__name__).warning(f'could not write schema cache {cachefile}')
+
+    def _on_pool_connect(self, dbapi_conn, conn_record):
+        self._pool_counts['connects'] += 1
+
+    def _on_pool_checkout(self, dbapi_conn, conn_record, conn_proxy):
+        counts = self._pool_counts
+        counts['checkouts'] += 1
+        pool = self.engine.pool
+        if isinstance(pool, QueuePool):
+            nout = pool.checkedout()
+            counts['peak_checked_out'] = max(nout, counts['peak_checked_out'])
+            if self._pool_limit is not None and nout >= self._pool_limit:
+                counts['saturated'] += 1
+
+    def _on_pool_checkin(self, dbapi_conn, conn_record):
+        self._pool_counts['checkins'] += 1
+
+    def _on_pool_invalidate(self, dbapi_conn, conn_record, exception):
+        self._pool_counts['invalidated'] += 1
+
+    def pool_stats(self):
+        """return dict of connection pool statistics:
+
+        pool             name of pool class
+        connects         number of new database connections opened
+        checkouts        number of connections checked out from the pool
+        checkins         number of connections returned to the pool
+        invalidated      number of connections discarded as stale or broken
+        saturated        number of checkouts that took the last free pool
+                         slot, so that any further request would wait
+        peak_checked_out largest number of connections in use at once
+
+        and, for a queue pool, the current 'size', 'checked_out',
+        'checked_in', and 'overflow'.
+        """
+        out = {'pool': None}
+        out.update(self._pool_counts)
+        if self.engine is None:
+            return out
+        pool = self.engine.pool
+        out['pool'] = pool.__class__.__name__
+        if isinstance(pool, QueuePool):
+            out.update({'size': pool.size(), 'checked_out': pool.checkedout(),
+                        'checked_in': pool.checkedin(),
+                        'overflow': pool.overflow()})
+        return out
+
+    @property
+    def _session(self):
+        "session of the transaction open in this thread, or None"
+        return getattr(self._local, 'session', None)
+
+    @_session.setter
+    def _session(self, session):
+        self._local.session = session
+
+    @property
+    def _txn_modify_date(self):
+        "whether the transaction open in this thread needs modify_date set"
+        return getattr(self._local, 'modify_date', False)
+
+    @_txn_modify_date.setter
+    def _txn_modify_date(self, value):
+        self._local.modify_date = value
+
     def get_session(self):
         return Session(self.engine)
 
@@ -137,14 +507,38 @@ class SimpleDB(object):
         with Session(self.engine) as session, session.begin():
             session.flush()
 
-    def execute(self, query, set_modify_date=False):
+    def execute(self, query, set_modify_date=False, params=None):
         """
         general execute of query, optionally setting 'modify date'
         and committing
+
+        params can be a dict of bound values, or a list of dicts
+        to run the query as an executemany.
+        """
+        return self.execute_batch([(query, params)],
+                                  set_modify_date=set_modify_date)
+
+    def execute_batch(self, queries, set_modify_date=False):
+        """
+        execute a list of (query, params) pairs in a single transaction,
+        optionally setting 'modify date' once for the whole batch.
+
+        returns the result of the last query
         """
         result = None
+        if self._session is not None:
+            for query, params in queries:
+                result = self._session.execute(query, params)
+            if set_modify_date:
+                self._txn_modify_date = True
+            return result
+
         with Session(self.engine) as session, session.begin():
-            result = session.execute(query)
+            for query, params in queries:
+                result = session.execute(query, params)
+            if result is not None and result.returns_rows:
+                # buffer rows before the connection goes back to the pool
+                result = result.freeze()()
             if set_modify_date:
                 q = self.set_info('modify_date', isotime(), do_execute=False)
                 if q is not None:
@@ -152,35 +546,239 @@ class SimpleDB(object):
             session.flush()
         return result
 
+    @contextmanager
+    def transaction(self):
+        """context manager for a unit of work:
+
+        >>> with db.transaction():
+        ...     db.insert('person', badge=1234, last_name='Smith')
+        ...     db.update('proposal', where={'id': 1001}, spokesperson_id=9)
+
+        all queries run in the block (get_rows, insert, update,
+        delete_rows, ...) share one session and connection, and are
+        committed together at the end of the block, with modify_date
+        set once.  Any exception rolls back the whole block.
+
+        Nested calls join the outer transaction.  Transactions are
+        per thread: other threads using the same SimpleDB do not join
+        the block, and run their queries in their own sessions.
+        """
+        if self._session is not None:
+            yield self._session
+            return
+
+        session = self._session = Session(self.engine)
+        self._txn_modify_date = False
+        try:
+            with session.begin():
+                yield session
+                if self._txn_modify_date:
+                    q = self.set_info('modify_date', isotime(), do_execute=False)
+                    if q is not None:
+                        session.execute(q)
+        except BaseException:
+            self.on_rollback()
+            raise
+        finally:
+            self._session = None
+            self._txn_modify_date = False
+            session.close()
+
+    def enable_stats(self, slow_count=SLOW_STATEMENT_COUNT):
+        """start collecting statistics of SQL statements (see stats()),
+        using engine events.  There is no overhead when not enabled."""
+        if self._stats is None:
+            self._stats = QueryStats(slow_count=slow_count)
+        self._listen_stats(True)
+
+    def disable_stats(self):
+        "stop collecting statistics of SQL statements"
+        self._stats = None
+        if len(self._stats_captures) == 0:
+            self._listen_stats(False)
+
+    def reset_stats(self):
+        "reset statistics of SQL statements"
+        if self._stats is not None:
+            self._stats.reset()
+
+    def stats(self):
+        """return dict of statistics of SQL statements since enable_stats():
+
+        statements   number of statements
+        rows         number of rows reported by the driver
+        time         total time (seconds) executing statements
+        methods      dict of 'statements', 'rows', 'time', and 'max_time'
+                     for each public method of the database object, with
+                     statements counted for the outermost public method
+                     (so BeamtimeDB.add_experiment, not get_rows)
+        slowest      list of slowest statements, with 'time', 'method',
+                     and 'statement'
+        """
+        if self._stats is None:
+            return {'enabled': False}
+        out = self._stats.as_dict()
+        out['enabled'] = True
+        return out
+
+    @contextmanager
+    def capture_stats(self, slow_count=SLOW_STATEMENT_COUNT):
+        """context manager capturing statistics of SQL statements for
+        one block of code, whether or not enable_stats() is used
+
+        >>> with db.capture_stats() as stats:
+        ...     db.add_experiment(...)
+        >>> print(stats.as_dict())
+        """
+        stats = QueryStats(slow_count=slow_count)
+        with self._stats_lock:
+            self._stats_captures.append(stats)
+        self._listen_stats(True)
+        try:
+            yield stats
+        finally:
+            with self._stats_lock:
+                self._stats_captures.remove(stats)
+            if self._stats is None and len(self._stats_captures) == 0:
+                self._listen_stats(False)
+
+    def _listen_stats(self, enable=True):
+        listening = event.contains(self.engine, 'after_cursor_execute',
+                                   self._after_cursor_execute)
+        if enable and not listening:
+            event.listen(self.engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(self.engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+        elif listening and not enable:
+            event.remove(self.engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.remove(self.engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get('query_start', None)
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        rows = cursor.rowcount if cursor.rowcount is not None else -1
+        method = self._stats_method()
+        with self._stats_lock:
+            if self._stats is not None:
+                self._stats.record(method, statement, elapsed, rows)
+            for stats in self._stats_captures:
+                stats.record(method, statement, elapsed, rows)
+
+    def _stats_method(self):
+        """name of outermost public method of this object in the call stack"""
+        method = None
+        frame = sys._getframe(2)
+        while frame is not None:
+            name = frame.f_code.co_name
+            if (not name.startswith('_') and frame.f_locals.get('self', None) is self):
+                method = name
+            frame = frame.f_back
+        return method or 'other'
+
+    def on_rollback(self):
+        """called when a transaction() block is rolled back, to discard
+        any cached state written in the block"""
+        self.clear_info_cache()
+
     def set_info(self, key, value, with_modify_time=True, do_execute=True):
         """set key / value in the info table
 
         use do_execute=False to avoid executing, and return the query
         """
         tab = self.tables['info']
-        val = self.get_rows('info', where={'key': key}, none_if_empty=True)
-        ivals = {'value': value}
+        ivals = {'key': key, 'value': value}
         if with_modify_time and 'modify_time' in tab.c:
-            ivals['modify_time'] = isotime()
-        if val is None:
-            ivals['key'] = key
-            query = tab.insert().values(**ivals)
+            ivals['modify_time'] = datetime.now()
+
+        query = self._upsert_query(tab, ('key',), ivals.keys())
+        if query is not None:
+            query = query.values(**ivals)
         else:
-            query = tab.update().where(tab.c.key==key).values(**ivals)
+            if self._info_cache_fresh():
+                exists = key in self._info_cache
+            else:
+                exists = self.get_rows('info', where={'key': key},
+                                       none_if_empty=True) is not None
+            if exists:
+                query = tab.update().where(tab.c.key==key).values(**ivals)
+            else:
+                query = tab.insert().values(**ivals)
+
+        if self._info_cache is not None:
+            row = self._info_cache.get(key, None)
+            if row is None:
+                row = self._info_row(**{c: None for c in tab.c.keys()})
+            self._info_cache[key] = row._replace(**ivals)
+
         if do_execute:
             self.execute(query, set_modify_date=True)
             return
         return query
 
+    def _info_cache_fresh(self):
+        return (self._info_cache is not None and
+                (time.monotonic() - self._info_cache_time) < self.info_cache_ttl)
+
+    def clear_info_cache(self):
+        "discard cached info table, to be re-read on next use"
+        self._info_cache = None
+
+    def _get_info_rows(self, key=None, prefix=None, order_by='modify_time'):
+        """rows of info table for key and/or key prefix, ordered by order_by,
+        from the info cache if info_cache_ttl is set"""
+        tab = self.tables['info']
+        if self.info_cache_ttl is not None:
+            if not self._info_cache_fresh():
+                query = tab.select()
+                if order_by in tab.c:
+                    query = query.order_by(tab.c[order_by])
+                self._info_row = namedtuple('InfoRow', tab.c.keys())
+                self._info_cache = {row.key: self._info_row(*row) for row in
+                                    self.execute(query).fetchall()}
+                self._info_cache_time = time.monotonic()
+            rows = list(self._info_cache.values())
+            if key is not None:
+                rows = [row for row in rows if row.key == key]
+            if prefix is not None:
+                rows = [row for row in rows if row.key.startswith(prefix)]
+            return rows
+
+        query = self._info_query(key=key, prefix=prefix)
+        if order_by in tab.c:
+            query = query.order_by(tab.c[order_by])
+        return self.execute(query).fetchall()
+
+    def _info_query(self, key=None, prefix=None):
+        """select query for info rows with key, or with keys starting
+        with prefix (matched literally, with LIKE wildcards escaped)"""
+        tab = self.tables['info']
+        query = tab.select()
+        if key is not None:
+            query = query.where(tab.c.key==key)
+        if prefix is not None:
+            like = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.where(tab.c.key.like(f'{like}%', escape='\\'))
+        return query
+
     def get_info(self, key=None, default=None, prefix=None, as_int=False,
                  as_bool=False, order_by='modify_time', full_row=False):
-        where = {}
-        if key is not None:
-            where['key'] = key
-        gi_kws = {}
-        if order_by in self.tables['info'].c:
-            gi_kws['order_by'] = order_by
-        allrows = self.get_rows('info', where, **gi_kws)
+        """get value(s) from the info table, for a key, for all keys
+        starting with prefix (as a dict), or for all keys (as a dict).
+
+        With info_cache_ttl set, values are read from a cache of the whole
+        info table, re-read after info_cache_ttl seconds.
+        """
+        allrows = self._get_info_rows(key=key, prefix=prefix, order_by=order_by)
 
         def cast(val, as_int, as_bool):
             if (as_int or as_bool):
@@ -215,11 +813,10 @@ class SimpleDB(object):
         else:
             out = {}
             for row in allrows:
-                if row.key.startswith(prefix):
-                    xout = row
-                    if not full_row:
-                        xout = xout.value
-                    out[row.key] = cast(xout, as_int, as_bool)
+                xout = row
+                if not full_row:
+                    xout = xout.value
+                out[row.key] = cast(xout, as_int, as_bool)
         return out
 
     def set_modify_time(self):
@@ -235,45 +832,474 @@ class SimpleDB(object):
         tab = self.tables[tablename]
         self.execute(tab.insert().values(**kws), set_modify_date=True)
 
+    def insert_many(self, tablename, rows):
+        """insert a list of dicts of keyword/value pairs to a table
+
+        All rows are sent as executemany() within one transaction, and
+        modify_date is set once for the batch.  Rows with different sets
+        of keys are grouped, one executemany per group.
+
+        Returns the number of rows inserted.
+        """
+        batch = self._insert_many_batch(tablename, rows)
+        if len(batch) == 0:
+            return 0
+        self.execute_batch(batch, set_modify_date=True)
+        return sum(len(params) for query, params in batch)
+
+    def _insert_many_batch(self, tablename, rows):
+        """list of (insert query, list of rows) for insert_many(), with
+        rows grouped by their set of keys"""
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'insert_many')
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row.keys())), []).append(dict(row))
+        return [(tab.insert(), group) for group in groups.values()]
+
+    def update_many(self, tablename, rows, key='id'):
+        """update many rows of a table in a single transaction
+
+        Arguments
+        ----------
+        tablename   name of table
+        rows        list of dicts of keyword/value pairs, each holding
+                    the value(s) of `key` to select the row to update
+                    and the column values to set
+        key         name (or tuple of names) of columns used to select
+                    rows to update ['id']
+
+        Rows setting the same columns are sent as one executemany(),
+        and modify_date is set once for the batch.
+
+        Returns the number of rows sent for update.
+        """
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'update_many')
+        keys = (key,) if isinstance(key, str) else tuple(key)
+        for keyname in keys:
+            if keyname not in tab.c:
+                self.table_error(f"no column '{keyname}'", tablename, 'update_many')
+
+        groups = {}
+        for row in rows:
+            vals = dict(row)
+            try:
+                params = {f'w_{k}': vals.pop(k) for k in keys}
+            except KeyError:
+                self.table_error(f"row without '{key}' values", tablename,
+                                 'update_many')
+            if len(vals) == 0:
+                continue
+            params.update(vals)
+            groups.setdefault(tuple(sorted(vals.keys())), []).append(params)
+        if len(groups) == 0:
+            return 0
+
+        where = and_(*[tab.c[k]==bindparam(f'w_{k}') for k in keys])
+        self.execute_batch([(tab.update().where(where), group)
+                            for group in groups.values()],
+                           set_modify_date=True)
+        return sum(len(group) for group in groups.values())
+
+    def has_unique_key(self, tablename, columns):
+        """whether a table has a primary key, unique constraint, or
+        unique index on exactly the named columns"""
+        memo_key = (tablename, frozenset(columns))
+        if memo_key not in self._unique_keys:
+            self._unique_keys[memo_key] = self._has_unique_key(tablename, columns)
+        return self._unique_keys[memo_key]
+
+    def _has_unique_key(self, tablename, columns):
+        tab = self.tables[tablename]
+        cols = set(columns)
+        if cols == set(c.name for c in tab.primary_key.columns):
+            return True
+        for con in tab.constraints:
+            if (isinstance(con, UniqueConstraint) and
+                cols == set(c.name for c in con.columns)):
+                return True
+        for index in tab.indexes:
+            if index.unique and cols == set(c.name for c in index.columns):
+                return True
+        if len(cols) == 1:
+            col = tab.c.get(list(cols)[0], None)
+            return col is not None and bool(col.unique)
+        return False
+
+    def _upsert_query(self, tab, conflict_cols, colnames, update_existing=True):
+        """native INSERT .. ON CONFLICT (PostgreSQL, SQLite) or
+        INSERT .. ON DUPLICATE KEY UPDATE (MySQL) query, or None if the
+        conflict columns have no unique key.  Existing rows are left
+        unchanged if there are no values to update: with ON CONFLICT DO
+        NOTHING, returning no row, or, for MySQL, with a no-op update."""
+        dialect = self.engine.dialect
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        elif dialect.name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+        else:
+            return None
+        if not self.has_unique_key(tab.name, conflict_cols):
+            return None
+        query = dialect_insert(tab)
+        if dialect.name == 'mysql':
+            setvals = {}
+            if update_existing:
+                setvals = {c: query.inserted[c] for c in colnames
+                           if c not in conflict_cols}
+            if len(setvals) == 0:
+                setvals = {conflict_cols[0]: tab.c[conflict_cols[0]]}
+            return query.on_duplicate_key_update(**setvals)
+        setvals = {}
+        if update_existing:
+            setvals = {c: query.excluded[c] for c in colnames
+                       if c not in conflict_cols}
+        if len(setvals) == 0:
+            return query.on_conflict_do_nothing(index_elements=list(conflict_cols))
+        return query.on_conflict_do_update(index_elements=list(conflict_cols),
+                                           set_=setvals)
+
+    def upsert(self, tablename, conflict_cols, update_existing=True, **values):
+        """insert a row, or update the existing row if one matches the
+        values for the `conflict_cols` columns, and return the row
+
+        Arguments
+        ----------
+        tablename        name of table
+        conflict_cols    name (or tuple of names) of columns identifying a row
+        update_existing  whether to set the other values for an existing row,
+                         or leave it unchanged [True]
+        values           keyword/value pairs for the row
+
+        When the conflict columns have a unique key, this uses INSERT .. ON
+        CONFLICT .. RETURNING in one query with PostgreSQL or SQLite, and
+        INSERT .. ON DUPLICATE KEY UPDATE then select with MySQL, so that
+        concurrent writers cannot add duplicate rows.  Without a unique key
+        (see schema.add_unique_indexes), it uses select-then-insert in one
+        transaction, which does not prevent duplicates from concurrent
+        writers.  modify_date is set only if a row is inserted or updated.
+
+        Examples
+        --------
+        >>> row = db.upsert('person', 'badge', badge=1234, last_name='Smith')
+        """
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'upsert')
+        cols = (conflict_cols,) if isinstance(conflict_cols, str) else tuple(conflict_cols)
+        for col in cols:
+            if col not in values:
+                self.table_error(f"no value for '{col}'", tablename, 'upsert')
+
+        query = self._upsert_query(tab, cols, values.keys(),
+                                   update_existing=update_existing)
+        where = {col: values[col] for col in cols}
+        if query is not None and not getattr(self.engine.dialect, 'insert_returning', False):
+            # MySQL: no RETURNING, so select the row afterward
+            with self.transaction():
+                row = None
+                if not update_existing:
+                    row = self.get_rows(tablename, where=dict(where),
+                                        limit_one=True, none_if_empty=True)
+                if row is None:
+                    self.execute(query.values(**values), set_modify_date=True)
+                    row = self.get_rows(tablename, where=dict(where),
+                                        limit_one=True, none_if_empty=True)
+                return row
+
+        if query is not None:
+            query = query.values(**values).returning(*tab.c)
+            with self.transaction():
+                row = self.execute(query).fetchone()
+                if row is not None:
+                    self._txn_modify_date = True
+                    return row
+            # existing row left unchanged
+            return self.get_rows(tablename, where=dict(where), limit_one=True,
+                                 none_if_empty=True)
+
+        with self.transaction():
+            row = self.get_rows(tablename, where=dict(where), limit_one=True,
+                                none_if_empty=True)
+            if row is None:
+                self.insert(tablename, **values)
+            elif update_existing:
+                newvals = {key: val for key, val in values.items()
+                           if key not in cols and getattr(row, key) != val}
+                if len(newvals) == 0:
+                    return row
+                self.update_many(tablename, [dict(where, **newvals)], key=cols)
+            else:
+                return row
+            return self.get_rows(tablename, where=dict(where), limit_one=True,
+                                 none_if_empty=True)
+
+    def _select_by_keys(self, tab, cols, group):
+        """select rows matching the keys of a dict {key: values},
+        returning {key: row}, for upsert_many()"""
+        found = {}
+        if len(cols) == 1:
+            query = tab.select().where(tab.c[cols[0]].in_(list(group.keys())))
+            for row in self.execute(query).fetchall():
+                found[getattr(row, cols[0])] = row
+        else:
+            for key, vals in group.items():
+                row = self.get_rows(tab.name, where={c: vals[c] for c in cols},
+                                    limit_one=True, none_if_empty=True)
+                if row is not None:
+                    found[key] = row
+        return found
+
+    def upsert_many(self, tablename, conflict_cols, rows, update_existing=True):
+        """upsert a list of dicts of keyword/value pairs to a table,
+        as with upsert(), in one transaction.
+
+        Returns a dict mapping the conflict column value (or tuple of values
+        for multiple conflict columns) to the primary key of each row.
+        """
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, 'upsert_many')
+        cols = (conflict_cols,) if isinstance(conflict_cols, str) else tuple(conflict_cols)
+        pkey = tab.c.id if 'id' in tab.c else list(tab.primary_key.columns)[0]
+
+        def rowkey(vals):
+            if len(cols) == 1:
+                return vals[cols[0]]
+            return tuple(vals[c] for c in cols)
+
+        # group rows by set of columns, keeping one row per key
+        groups = {}
+        for row in rows:
+            for col in cols:
+                if col not in row:
+                    self.table_error(f"row without value for '{col}'", tablename,
+                                     'upsert_many')
+            groups.setdefault(tuple(sorted(row.keys())), {})[rowkey(row)] = dict(row)
+
+        idmap = {}
+        if len(groups) == 0:
+            return idmap
+        with self.transaction():
+            for colnames, group in groups.items():
+                query = self._upsert_query(tab, cols, colnames,
+                                           update_existing=update_existing)
+                if (query is not None and
+                    getattr(self.engine.dialect, 'insert_executemany_returning', False)):
+                    query = query.returning(pkey, *[tab.c[c] for c in cols])
+                    result = self.execute(query, params=list(group.values()))
+                    rows = result.fetchall()
+                    if len(rows) > 0:
+                        self._txn_modify_date = True
+                    for row in rows:
+                        idmap[rowkey(row._mapping)] = row[0]
+                    # existing rows left unchanged return nothing
+                    missing = {key: vals for key, vals in group.items()
+                               if key not in idmap}
+                    if len(missing) > 0:
+                        for key, row in self._select_by_keys(tab, cols, missing).items():
+                            idmap[key] = getattr(row, pkey.name)
+                    continue
+
+                existing = self._select_by_keys(tab, cols, group)
+                newrows = {key: vals for key, vals in group.items()
+                           if key not in existing}
+                if update_existing:
+                    self.update_many(tablename, [vals for key, vals in group.items()
+                                                 if key in existing], key=cols)
+                if len(newrows) > 0:
+                    if query is not None:
+                        # rows added by another writer since the select
+                        # are left or updated, not duplicated
+                        self.execute(query, params=list(newrows.values()),
+                                     set_modify_date=True)
+                    else:
+                        self.insert_many(tablename, list(newrows.values()))
+                    existing.update(self._select_by_keys(tab, cols, newrows))
+                for key in group:
+                    idmap[key] = getattr(existing[key], pkey.name)
+        return idmap
+
     def table_error(self, message, tablename, funcname):
         raise ValueError(f"{message} for table '{tablename}' in {funcname}()")
 
-    def handle_where(self, tablename, where=None, funcname=None, **kws):
+    def _where_items(self, tablename, where=None, funcname=None, **kws):
+        """interpret a `where` value for a table, returning a list of
+        (keyname, column name, op, value) with op 'eq', 'in', or 'null'.
+        An empty list selects all rows.
+        """
         if funcname is None:
             funcname = 'handle_where'
         tab = self.tables.get(tablename, None)
         if tab is None:
             self.table_error(f"no table found", tablename, funcname)
 
-        filters = []
+        items = []
         if where is None or isinstance(where, bool) and where:
             where = {}
-            if len(kws) == 0:
-                filters.append(True)
 
         if isinstance(where, int):
             if 'id' in tab.c:
-                filters.append(tab.c.id==where)
-                print(" .(id).  ", where)
+                items.append(('id', 'id', 'eq', where))
             else:
                 for colname, coldat in tab.columns.items():
                     if coldat.primary_key and isinstance(coldat.type, INTEGER):
-                        filters.append(getattr(tab.c, colname)==where)
-            if len(filters) == 0:
+                        items.append((colname, colname, 'eq', where))
+            if len(items) == 0:
                 self.table_error(f"could not interpret integer `where` value",
                                       tablename, funcname)
         elif isinstance(where, dict):
             where.update(kws)
             for keyname, val in where.items():
-                key = getattr(tab.c, keyname, None)
-                if key is None:
-                    key = getattr(tab.c, "%s_id" % keyname, None)
-                if key is None:
-                    self.table_error(f"no column '{keyname}'", tablename, funcname)
-                filters.append(key==val)
+                colname = self._where_colnames.get((tablename, keyname), None)
+                if colname is None:
+                    if keyname in tab.c:
+                        colname = keyname
+                    elif f"{keyname}_id" in tab.c:
+                        colname = f"{keyname}_id"
+                    else:
+                        self.table_error(f"no column '{keyname}'", tablename, funcname)
+                    self._where_colnames[(tablename, keyname)] = colname
+                if val is None:
+                    items.append((keyname, colname, 'null', None))
+                elif isinstance(val, (list, tuple, set, frozenset)):
+                    items.append((keyname, colname, 'in', list(val)))
+                else:
+                    items.append((keyname, colname, 'eq', val))
+        return items
 
+    def handle_where(self, tablename, where=None, funcname=None, **kws):
+        """build where clause for a table from `where`, either an int
+        for the id (or other integer primary key), or a dict of
+        column name / value pairs, with list values selecting
+        any of the values and None selecting NULL.
+        """
+        tab = self.tables.get(tablename, None)
+        filters = []
+        for keyname, colname, op, val in self._where_items(tablename, where=where,
+                                                           funcname=funcname, **kws):
+            col = tab.c[colname]
+            if op == 'null':
+                filters.append(col.is_(None))
+            elif op == 'in':
+                filters.append(col.in_(val))
+            else:
+                filters.append(col==val)
+        if len(filters) == 0:
+            filters.append(true())
         return and_(*filters)
 
+    def statement_cache_info(self):
+        """return dict of statement cache 'hits', 'misses', and 'size'
+        for get_rows()"""
+        out = dict(self._stmt_cache_stats)
+        out['size'] = len(self._stmt_cache)
+        return out
+
+    def clear_statement_cache(self):
+        "clear the get_rows() statement cache and cached unique keys"
+        self._stmt_cache.clear()
+        self._where_colnames.clear()
+        self._unique_keys.clear()
+
+    def _select_query(self, tablename, where=None, order_by=None, limit_one=False,
+                      funcname='get_rows', **kws):
+        """return (select query, params) for get_rows(), using the
+        statement cache"""
+        tab = self.tables.get(tablename, None)
+        if tab is None:
+            self.table_error(f"no table found", tablename, funcname)
+
+        if isinstance(where, dict):
+            where = dict(where)
+        items = self._where_items(tablename, where=where, funcname=funcname, **kws)
+
+        if order_by is None:
+            if 'id' in tab.c:
+                order_by = 'id'
+        elif order_by not in tab.c:
+            oid = f'{order_by}_id'
+            if oid in tab.c:
+                order_by = oid
+            else:
+                order_by = None
+
+        params = {}
+        for keyname, colname, op, val in items:
+            if op != 'null':
+                params[f'w_{keyname}'] = val
+        cache_key = (tablename, tuple((item[0], item[2]) for item in items),
+                     order_by, limit_one)
+        query = self._stmt_cache.get(cache_key, None)
+        if query is None:
+            self._stmt_cache_stats['misses'] += 1
+            filters = []
+            for keyname, colname, op, val in items:
+                col = tab.c[colname]
+                if op == 'null':
+                    filters.append(col.is_(None))
+                elif op == 'in':
+                    filters.append(col.in_(bindparam(f'w_{keyname}', expanding=True)))
+                else:
+                    filters.append(col==bindparam(f'w_{keyname}'))
+            query = tab.select()
+            if len(filters) > 0:
+                query = query.where(and_(*filters))
+            if order_by is not None:
+                query = query.order_by(tab.c[order_by])
+            if limit_one:
+                query = query.limit(1)
+            if len(self._stmt_cache) >= STMT_CACHE_SIZE:
+                self._stmt_cache.clear()
+            self._stmt_cache[cache_key] = query
+        else:
+            self._stmt_cache_stats['hits'] += 1
+        return query, params
+
+
+    def iter_rows(self, tablename, where=None, order_by=None, batch_size=1000,
+                  **kws):
+        """iterate over rows of a table, as for get_rows(), without holding
+        all rows in memory:
+
+        rows are read in batches of `batch_size`, using a server-side cursor
+        where the database supports it (PostgreSQL), and fetchmany() otherwise.
+
+        Examples
+        --------
+        >>> for row in db.iter_rows('experiment_person', batch_size=5000):
+        ...     print(row.experiment_id, row.person_id)
+        """
+        query, params = self._select_query(tablename, where=where, order_by=order_by,
+                                           funcname='iter_rows', **kws)
+        if self._session is not None:
+            yield from self._stream_rows(self._session.connection(), query,
+                                         params, batch_size)
+            return
+        with self.engine.connect() as conn:
+            yield from self._stream_rows(conn, query, params, batch_size)
+
+    def _stream_rows(self, conn, query, params, batch_size):
+        if self.engine.dialect.supports_server_side_cursors:
+            query = query.execution_options(stream_results=True,
+                                            yield_per=batch_size)
+            result = conn.execute(query, params)
+            for partition in result.partitions(batch_size):
+                yield from partition
+        else:
+            result = conn.execute(query, params)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield from rows
+        result.close()
+
     def get_rows(self, tablename, where=None, order_by=None, limit_one=False,
                 none_if_empty=False, **kws):
         """general-purpose select of row data:
@@ -290,31 +1316,24 @@ class SimpleDB(object):
         -------
         rows matching `where` (all if `where=None`) optionally ordered by order_by
 
+        Notes
+        -----
+        Values in `where` that are lists (or tuples or sets) select rows
+        matching any of the values, as with SQL 'IN'.
+
+        Select statements use bound parameters and are cached, keyed by
+        table, where columns, order_by and limit_one, so that repeated
+        lookups skip building and compiling the statement.
+        See statement_cache_info().
+
         Examples
         --------
         >>> db.get_rows('element', where{'z': 30})
         """
-        tab = self.tables.get(tablename, None)
-        if tab is None:
-            self.table_error(f"no table found", tablename, 'get_rows')
-
-        where = self.handle_where(tablename, where=where, funcname='get_rows', **kws)
-        query = tab.select().where(where)
-
-        if order_by is None:
-            if 'id' in tab.c:
-                order_by = 'id'
-        elif order_by not in tab.c:
-            oid = f'{order_by}_id'
-            if oid in tab.c:
-                order_by = oid
-            else:
-                order_by = None
-
-        if order_by is not None:
-            query = query.order_by(order_by)
-
-        result = self.execute(query)
+        query, params = self._select_query(tablename, where=where,
+                                           order_by=order_by, limit_one=limit_one,
+                                           funcname='get_rows', **kws)
+        result = self.execute(query, params=params)
         if limit_one:
             result = result.fetchone()
         else:
@@ -324,6 +1343,23 @@ class SimpleDB(object):
             result = None
         return result
     
+    def get_rows_in(self, tablename, column, values, where=None):
+        """get rows of a table with `column` matching any of `values`,
+        and optionally other `where` values, using IN lists of at most
+        MAX_IN_VALUES values, so that long lists of values can be used.
+
+        Examples
+        --------
+        >>> db.get_rows_in('person', 'badge', badges)
+        """
+        values = list(values)
+        rows = []
+        for i in range(0, len(values), MAX_IN_VALUES):
+            rwhere = {} if where is None else dict(where)
+            rwhere[column] = values[i:i+MAX_IN_VALUES]
+            rows.extend(self.get_rows(tablename, where=rwhere))
+        return rows
+
     def get_row(self, tablename, where=None):
         """get a single row or None if empty"""
         return self.get_rows(tablename, where=where, limit_one=True, none_if_empty=True)
@@ -1,14 +1,19 @@
 import os
+import json
 import time
+import hashlib
 import logging
 from warnings import warn
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from dateutil.parser import parse as dateparse
 from pytz import timezone
 
-from epics import get_pv, caput
+from epics import get_pv, poll
 
 from .beamtimedb import BeamtimeDB
+from .matcher import ProposalMatcher
+from .schema import add_sync_fingerprint_table, add_unique_indexes
 
 try:
     from apsbss.server_interface import Server as BSS_Server
@@ -22,161 +27,496 @@ BEAMLINES = {'13': {'13IDE:bss:': '13-ID-E',
                     '13BMC:bss:': '13-BM-C'}
              }
 
-def filldb_from_apsbss(sector='13', run=None):
-    beamlines = BEAMLINES[sector]
+# seconds to wait for concurrent APS BSS requests
+BSS_FETCH_TIMEOUT = 120
 
-    bt_db = BeamtimeDB()
-    
+# seconds to wait for all PV puts of one update to complete
+PV_PUT_TIMEOUT = 10
+
+def connect_bss(bt_db):
+    """connect to APS BSS Server, using DM_APS_DB_WEB_SERVICE_URL
+    from the beamtime database info table"""
     dm_url = bt_db.get_info('DM_APS_DB_WEB_SERVICE_URL')
     os.environ['DM_APS_DB_WEB_SERVICE_URL'] = dm_url
     try:
-        bss_server = BSS_Server()
+        return BSS_Server()
     except:
         raise ValueError(f'cannot connect to APSBSS Server with {dm_url=}')
 
-    if run is None:
-        run = bss_server.current_run
-    
-    current_esafs = bss_server.esafs(sector, run=run)
-
-    for esaf in current_esafs:
-        # print('esaf ', esaf.esaf_id, esaf.title)
-        user_ids = []
-        spokesperson = None
-        for user in esaf._users:
-            d_user = bt_db.get_user(badge=user.badge)
-            if d_user is None:
-                d_user = bt_db.add_user(badge=int(user.badge), last_name=user.lastName,
-                                        first_name=user.firstName, email=user.email)
-            user_ids.append(d_user.id)
-            if user.is_pi:
-                spokesperson = d_user.id
-
-        if  bt_db.get_experiment(esaf.esaf_id) is None:
-            bt_db.add_experiment(esaf.esaf_id, run=esaf.run, esaf_status=esaf.status,
-                                 start_date=esaf.startDate, end_date=esaf.endDate,
-                                 title=esaf.title, description=esaf.description,
-                                 spokesperson=spokesperson, users=user_ids)
-
-    # proposals
-    for prefix, beamline in beamlines.items():
-        for propid, prop in bss_server.current_proposals(beamline).items():
-            # print(f'proosal {prefix=}, {beamline=}, {propid=}') 
-            spokesperson = None
+def fetch_bss_data(bss_server, sector='13', run=None, current_esafs=False,
+                   workers=None, timeout=BSS_FETCH_TIMEOUT):
+    """fetch ESAFs for a sector and proposals for each of its beamlines
+    from the APS BSS, with all requests made concurrently in a thread pool
+
+    Arguments
+    ----------
+    bss_server     APS BSS Server
+    sector         sector name ['13']
+    run            run name, or None for the current run [None]
+    current_esafs  whether to fetch only current ESAFs, using
+                   current_esafs(), rather than all ESAFs for the run [False]
+    workers        number of threads [None: one per request]
+    timeout        seconds to wait for all requests [BSS_FETCH_TIMEOUT]
+
+    Returns
+    -------
+    dict with 'esafs': list of ESAFs, 'proposals': dict of
+    {beamline: {proposal id: proposal}}, and 'run': name of the run
+    of the ESAFs (None with current_esafs=True)
+
+    With run=None, the current run is looked up before the ESAFs are
+    requested for that run, and proposals come from current_proposals().
+    """
+    beamlines = list(BEAMLINES[sector].values())
+    if workers is None:
+        workers = len(beamlines) + 1
+    pool = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+    try:
+        esaf_run = None
+        if current_esafs:
+            esaf_future = pool.submit(bss_server.current_esafs, sector)
+        else:
+            esaf_run = bss_server.current_run if run is None else run
+            esaf_future = pool.submit(bss_server.esafs, sector, run=esaf_run)
+        prop_futures = {}
+        for beamline in beamlines:
+            if run is None:
+                prop_futures[beamline] = pool.submit(bss_server.current_proposals,
+                                                     beamline)
+            else:
+                prop_futures[beamline] = pool.submit(bss_server.proposals,
+                                                     beamline, run=run)
+        done, pending = wait([esaf_future, *prop_futures.values()], timeout=timeout)
+        if len(pending) > 0:
+            raise TimeoutError(f'APS BSS requests not finished after {timeout} s')
+        return {'run': esaf_run, 'esafs': esaf_future.result(),
+                'proposals': {bl: fut.result() for bl, fut in prop_futures.items()}}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def resolve_people(bt_db, people, affiliations=None):
+    """get person ids for many people at once
+
+    Arguments
+    ----------
+    bt_db         BeamtimeDB
+    people        dict of badge: dict of person values (first_name,
+                  last_name, email) for people that may need to be added
+    affiliations  dict of badge: institution name [None]
+
+    All badges are looked up with one IN query, institutions likewise,
+    missing institutions and people are bulk-inserted, and only
+    changed affiliations are updated.
+
+    Returns
+    -------
+    dict of badge: person id, dict of counts of added / updated rows
+    """
+    if affiliations is None:
+        affiliations = {}
+    counts = {'people_added': 0, 'institutions_added': 0,
+              'affiliations_updated': 0}
+
+    inst_ids = {}
+    inst_names = set(affiliations.values())
+    if len(inst_names) > 0:
+        for row in bt_db.get_rows_in('institution', 'name', inst_names):
+            inst_ids.setdefault(row.name, row.id)
+        newinsts = [name for name in inst_names if name not in inst_ids]
+        if len(newinsts) > 0:
+            bt_db.insert_many('institution', [{'name': name} for name in newinsts])
+            for row in bt_db.get_rows_in('institution', 'name', newinsts):
+                inst_ids.setdefault(row.name, row.id)
+            counts['institutions_added'] = len(newinsts)
+
+    person_ids = {}
+    updates = []
+    for row in bt_db.get_rows_in('person', 'badge', people.keys()):
+        person_ids[row.badge] = row.id
+        inst_id = inst_ids.get(affiliations.get(row.badge, None), None)
+        if inst_id is not None and inst_id != row.affiliation_id:
+            updates.append({'badge': row.badge, 'affiliation_id': inst_id})
+
+    newpeople = []
+    for badge, vals in people.items():
+        if badge not in person_ids:
+            vals = dict(vals, badge=badge)
+            inst_id = inst_ids.get(affiliations.get(badge, None), None)
+            if inst_id is not None:
+                vals['affiliation_id'] = inst_id
+            newpeople.append(vals)
+    if len(newpeople) > 0:
+        bt_db.insert_many('person', newpeople)
+        for row in bt_db.get_rows_in('person', 'badge',
+                                     [vals['badge'] for vals in newpeople]):
+            person_ids[row.badge] = row.id
+        counts['people_added'] = len(newpeople)
+
+    if len(updates) > 0:
+        bt_db.update_many('person', updates, key='badge')
+        counts['affiliations_updated'] = len(updates)
+    return person_ids, counts
+
+def _isodate(dtime):
+    return None if dtime is None else dtime.isoformat()
+
+def fingerprint(payload):
+    "content fingerprint (sha1 hex digest) of a JSON-able payload"
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def esaf_fingerprint(esaf):
+    "content fingerprint of an ESAF from the APS BSS"
+    users = sorted((str(u.badge), u.lastName, u.firstName, u.email, bool(u.is_pi))
+                   for u in esaf._users)
+    return fingerprint({'id': esaf.esaf_id, 'run': esaf.run,
+                        'status': esaf.status, 'title': esaf.title,
+                        'description': esaf.description,
+                        'start': _isodate(esaf.startDate),
+                        'end': _isodate(esaf.endDate), 'users': users})
+
+def proposal_fingerprint(prop):
+    "content fingerprint of a proposal from the APS BSS"
+    users = sorted((str(u['badge']), u['lastName'], u['firstName'],
+                    u.get('email', 'unknown'), u['institution'],
+                    u['piFlag'] in (True, 'Y', 'y'))
+                   for u in prop.to_dict()['experimenters'])
+    return fingerprint({'title': prop.title.strip(), 'users': users})
+
+def get_fingerprints(bt_db, kind, ids):
+    "stored fingerprints for records of a kind, as dict of id: fingerprint"
+    out = {}
+    for row in bt_db.get_rows_in('sync_fingerprint', 'record_id', ids,
+                                 where={'kind': kind}):
+        out[row.record_id] = row.fingerprint
+    return out
+
+def filldb_from_apsbss(sector='13', run=None, bt_db=None, bss_server=None,
+                       incremental=False, workers=None, timeout=BSS_FETCH_TIMEOUT):
+    """fill beamtime database with ESAFs, proposals, and people from
+    the APS BSS for a sector and run (default: current run)
+
+    People from all ESAFs and proposals are resolved together (see
+    resolve_people()), and all database writes are made in one transaction.
+
+    By default, ESAFs and proposals already in the database are skipped.
+    With incremental=True, a content fingerprint of each ESAF and proposal
+    is kept in the sync_fingerprint table, and records whose fingerprint
+    changed are updated, including the people for each experiment.
+    Records with unchanged fingerprints cause no database writes.
+
+    ESAFs and proposals are first fetched from the BSS concurrently, with
+    `workers` threads and `timeout` seconds (see fetch_bss_data()), and
+    then written to the database.
+
+    Returns dict of counts, including 'queries', the number of SQL
+    statements sent to the database.
+    """
+    if bt_db is None:
+        bt_db = BeamtimeDB()
+    if bss_server is None:
+        bss_server = connect_bss(bt_db)
+    # unique keys for upsert(), for databases made without them
+    add_unique_indexes(bt_db)
+
+    # with run=None, the current run's proposals come from current_proposals()
+    bss_data = fetch_bss_data(bss_server, sector=sector, run=run,
+                              workers=workers, timeout=timeout)
+    run = bss_data['run']
+    current_esafs = bss_data['esafs']
+    proposals = {}
+    for beamline, props in bss_data['proposals'].items():
+        proposals.update(props)
+
+    with bt_db.capture_stats() as stats, bt_db.transaction():
+        esafs, props = current_esafs, proposals
+        new_fprints = []
+        if incremental:
+            add_sync_fingerprint_table(bt_db)
+            stored = get_fingerprints(bt_db, 'esaf',
+                                      [esaf.esaf_id for esaf in current_esafs])
+            esafs = []
+            for esaf in current_esafs:
+                fprint = esaf_fingerprint(esaf)
+                if stored.get(esaf.esaf_id, None) != fprint:
+                    esafs.append(esaf)
+                    new_fprints.append({'kind': 'esaf', 'record_id': esaf.esaf_id,
+                                        'fingerprint': fprint,
+                                        'modify_time': datetime.now()})
+            stored = get_fingerprints(bt_db, 'proposal', proposals.keys())
+            props = {}
+            for propid, prop in proposals.items():
+                fprint = proposal_fingerprint(prop)
+                if stored.get(propid, None) != fprint:
+                    props[propid] = prop
+                    new_fprints.append({'kind': 'proposal', 'record_id': propid,
+                                        'fingerprint': fprint,
+                                        'modify_time': datetime.now()})
+
+        # collect all people, then resolve them together
+        people, affiliations = {}, {}
+        for esaf in esafs:
+            for user in esaf._users:
+                people.setdefault(int(user.badge),
+                                  {'first_name': user.firstName,
+                                   'last_name': user.lastName,
+                                   'email': user.email})
+        for propid, prop in props.items():
             for user in prop.to_dict()['experimenters']:
                 badge = int(user['badge'])
-                affil = user['institution']
-                inst = bt_db.get_institution(name=affil)
-                if inst is None:
-                    inst = bt_db.add_institution(affil)
-
-                b_user = bt_db.get_user(badge=badge)
-                if b_user is None:
-                    if 'email' not in user:
-                        user['email'] = 'unknown'
-                    b_user = bt_db.add_user(user['firstName'], user['lastName'],
-                                            user['email'], badge)
-
-                bt_db.update('person', where={'badge': badge}, affiliation_id=inst.id)
-                if user['piFlag'] in (True, 'Y', 'y'):
-                    spokesperson = b_user.id
+                people.setdefault(badge, {'first_name': user['firstName'],
+                                          'last_name': user['lastName'],
+                                          'email': user.get('email', 'unknown')})
+                affiliations[badge] = user['institution']
+        person_ids, counts = resolve_people(bt_db, people, affiliations)
 
+        # experiments
+        counts['experiments_added'] = counts['experiments_updated'] = 0
+        known = set(row.id for row in bt_db.get_rows_in('experiment', 'id',
+                                                        [esaf.esaf_id for esaf in esafs]))
+        for esaf in esafs:
+            if esaf.esaf_id in known and not incremental:
+                continue
+            user_ids = []
+            spokesperson = None
+            for user in esaf._users:
+                user_ids.append(person_ids[int(user.badge)])
+                if user.is_pi:
+                    spokesperson = user_ids[-1]
+            if esaf.esaf_id in known:
+                bt_db.update_experiment(esaf.esaf_id, run=esaf.run,
+                                        esaf_status=esaf.status,
+                                        start_date=esaf.startDate,
+                                        end_date=esaf.endDate,
+                                        title=esaf.title,
+                                        description=esaf.description,
+                                        spokesperson=spokesperson, users=user_ids)
+                counts['experiments_updated'] += 1
+            else:
+                bt_db.add_experiment(esaf.esaf_id, run=esaf.run, esaf_status=esaf.status,
+                                     start_date=esaf.startDate, end_date=esaf.endDate,
+                                     title=esaf.title, description=esaf.description,
+                                     spokesperson=spokesperson, users=user_ids)
+                known.add(esaf.esaf_id)
+                counts['experiments_added'] += 1
+
+        # proposals
+        known = set(row.id for row in bt_db.get_rows_in('proposal', 'id',
+                                                        props.keys()))
+        newprops, changed = [], []
+        for propid, prop in props.items():
+            if propid in known and not incremental:
+                continue
             title = prop.title
             if title.endswith('\n'):
                 title = title[:-1]
-            kws = {'title': title}
-            if spokesperson is not None:
-                kws['spokesperson_id'] = spokesperson
-            b_prop = bt_db.get_proposal(propid)
-            if b_prop is None:
-                b_prop = bt_db.add_proposal(propid, **kws)
-                
+            kws = {'id': propid, 'title': title}
+            for user in prop.to_dict()['experimenters']:
+                if user['piFlag'] in (True, 'Y', 'y'):
+                    kws['spokesperson_id'] = person_ids[int(user['badge'])]
+            if propid in known:
+                changed.append(kws)
+            else:
+                newprops.append(kws)
+        if len(newprops) > 0:
+            bt_db.insert_many('proposal', newprops)
+        if len(changed) > 0:
+            bt_db.update_many('proposal', changed)
+        counts['proposals_added'] = len(newprops)
+        counts['proposals_updated'] = len(changed)
+
+        if len(new_fprints) > 0:
+            bt_db.upsert_many('sync_fingerprint', ('kind', 'record_id'), new_fprints)
+
+    counts.update({'run': run, 'esafs': len(current_esafs),
+                   'proposals': len(proposals), 'people': len(people),
+                   'unchanged': (len(current_esafs) - len(esafs) +
+                                 len(proposals) - len(props)),
+                   'queries': stats.statements})
+    print(f"filldb_from_apsbss: run {run}: {len(current_esafs)} ESAFs, "
+          f"{len(proposals)} proposals, {len(people)} people, "
+          f"{counts['unchanged']} unchanged, {stats.statements} queries")
+    return counts
+
+
+class PVWriter(object):
+    """write values to Epics PVs, keeping PVs connected between updates
+    and sending only values that changed since the last write.
+
+    Values given to put() are held until flush(), so that the last value
+    put to a PV wins.  flush() waits for all PVs to connect together, then
+    sends the values with non-blocking puts, which are also all waited for
+    together, so that a flush takes at most 2*timeout however many PVs
+    are disconnected.
+
+    >>> writer = PVWriter()
+    >>> writer.put('13IDE:bss:esaf:id', '283901')
+    >>> writer.flush()
+    {'sent': 1, 'skipped': 0, 'failed': 0}
+    """
+    def __init__(self, timeout=PV_PUT_TIMEOUT):
+        self.timeout = timeout
+        self.pvs = {}
+        self.last_values = {}
+        self.pending = {}
+        self.counts = {'sent': 0, 'skipped': 0, 'failed': 0}
+
+    def get_pv(self, pvname):
+        "connected PV for a PV name"
+        if pvname not in self.pvs:
+            self.pvs[pvname] = get_pv(pvname,
+                                      connection_callback=self._onconnect)
+        return self.pvs[pvname]
+
+    def _onconnect(self, pvname=None, conn=None, **kws):
+        # an IOC that reconnects may have lost its values: send them again
+        if not conn:
+            self.last_values.pop(pvname, None)
+
+    def put(self, pvname, value):
+        "set value for a PV, to be written with flush()"
+        self.pending[pvname] = value
+
+    def forget(self, pvname=None):
+        "forget last written values, so that they are written again"
+        if pvname is None:
+            self.last_values = {}
+        else:
+            self.last_values.pop(pvname, None)
+
+    def flush(self, timeout=None):
+        """write pending values that differ from the last written values,
+        and wait for all puts to complete.
+
+        Returns dict of counts of 'sent', 'skipped', and 'failed' puts for
+        this flush. Values of failed puts will be sent again on next flush.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        pending, self.pending = self.pending, {}
+        counts = {'sent': 0, 'skipped': 0, 'failed': 0}
+        # create all PVs first, so that they connect together
+        topush = []
+        for pvname, value in pending.items():
+            if (pvname in self.last_values and
+                self.last_values[pvname] == value):
+                counts['skipped'] += 1
+                continue
+            topush.append((pvname, self.get_pv(pvname), value))
 
+        t0 = time.monotonic()
+        while (any(not pv.connected for _n, pv, _v in topush) and
+               time.monotonic() - t0 < timeout):
+            poll(evt=1.e-3, iot=0.01)
 
-def update_pvs(sector='13'):
+        puts = []
+        for pvname, pv, value in topush:
+            if not pv.connected:
+                counts['failed'] += 1
+                continue
+            pv.put(value, wait=False, use_complete=True)
+            puts.append((pvname, pv, value))
+
+        t0 = time.monotonic()
+        while (any(not pv.put_complete for _n, pv, _v in puts) and
+               time.monotonic() - t0 < timeout):
+            poll(evt=1.e-3, iot=0.01)
+
+        for pvname, pv, value in puts:
+            if pv.put_complete:
+                self.last_values[pvname] = value
+                counts['sent'] += 1
+            else:
+                self.last_values.pop(pvname, None)
+                counts['failed'] += 1
+        for key, val in counts.items():
+            self.counts[key] += val
+        return counts
+
+
+def update_pvs(sector='13', workers=None, timeout=BSS_FETCH_TIMEOUT,
+               bt_db=None, bss_server=None, pv_writer=None):
+    """update Epics PVs for the current proposal and ESAF of each beamline
+    of a sector from the APS BSS
+
+    Arguments
+    ----------
+    sector      sector name ['13']
+    workers     number of concurrent APS BSS requests [one per beamline]
+    timeout     seconds to wait for APS BSS requests
+    bt_db       BeamtimeDB, used to connect to the APS BSS
+    bss_server  connected APS BSS Server [None, connect from bt_db]
+    pv_writer   PVWriter [None, use a new PVWriter]
+
+    Returns dict of counts of PV puts 'sent', 'skipped' and 'failed'.
+    Using the same PVWriter for repeated updates keeps PVs connected
+    and sends only changed values.
+    """
     beamlines = BEAMLINES[sector]
-    bt_db = BeamtimeDB()
-    
-    dm_url = bt_db.get_info('DM_APS_DB_WEB_SERVICE_URL')
-    os.environ['DM_APS_DB_WEB_SERVICE_URL'] = dm_url
-    try:
-        bss_server = BSS_Server()
-    except:
-        raise ValueError(f'cannot connect to APSBSS Server with {dm_url=}')
+    if pv_writer is None:
+        pv_writer = PVWriter()
+    if bss_server is None:
+        if bt_db is None:
+            bt_db = BeamtimeDB(tables=['info'])
+        bss_server = connect_bss(bt_db)
+    bss_data = fetch_bss_data(bss_server, sector=sector, current_esafs=True,
+                              workers=workers, timeout=timeout)
     
     tzone = timezone('America/Chicago')
     cycle = bss_server.current_run
 
+    put = pv_writer.put
     for prefix, name in beamlines.items():
-        get_pv(f"{prefix}proposal:beamline")
-        get_pv(f"{prefix}esaf:cycle")
-        prop_pv = get_pv(f"{prefix}proposal:id")
-        esaf_pv = get_pv(f"{prefix}esaf:id")
-
-        caput(f"{prefix}proposal:beamline", name)
-        caput(f"{prefix}esaf:cycle", cycle)
+        put(f"{prefix}proposal:beamline", name)
+        put(f"{prefix}esaf:cycle", cycle)
 
     current_time = datetime.now().astimezone(tzone)
-    curr_props = {}
-    prop_badges = {}
+    matcher = ProposalMatcher()
     for prefix, name in beamlines.items():
-        props = bss_server.current_proposals(name)
-        # print(f"{prefix} {name} {len(props):d} proposals for this cycle")
+        props = bss_data['proposals'][name]
+        if len(props) == 0:
+            continue
         current_prop = None
         for propid, prop in props.items():
             start_time = prop.startDate.astimezone(tzone)
             end_time = prop.endDate.astimezone(tzone)
             if start_time < current_time and current_time < end_time:
                 current_prop = propid
-                # print(f" Current : {propid=}   {prefix=}, {name=}")
         if current_prop is None:
-            current_prop = propid                
+            current_prop = propid
         prop = props[current_prop]
         start_date = prop.startDate.isoformat(sep=' ', timespec='seconds')
-        end_date = prop.endDate.isoformat(sep=' ', timespec='seconds')        
-        curr_props[prefix] = [prop.lastNames, prop.startDate, prop.endDate]
-        caput(f"{prefix}proposal:id", str(current_prop))
-        caput(f"{prefix}proposal:startDate", start_date)
-        caput(f"{prefix}proposal:endDate", end_date)
-        caput(f"{prefix}proposal:title", prop.title)
-        caput(f"{prefix}proposal:userBadges", ', '.join(prop.badges))
-        caput(f"{prefix}proposal:users", ', '.join(prop.lastNames))
-        
-    # print("Look for ESAFS " , sector)
-    # print("Current Proposals: ")
-    # for _x, _k in curr_props.items():
-    #     print("   ", _x , _k[0])
-    # print("####")
-    
-    for esaf in bss_server.current_esafs(sector):
+        end_date = prop.endDate.isoformat(sep=' ', timespec='seconds')
+        matcher.add(prefix, prop.badges, prop.lastNames)
+        put(f"{prefix}proposal:id", str(current_prop))
+        put(f"{prefix}proposal:startDate", start_date)
+        put(f"{prefix}proposal:endDate", end_date)
+        put(f"{prefix}proposal:title", prop.title)
+        put(f"{prefix}proposal:userBadges", ', '.join(prop.badges))
+        put(f"{prefix}proposal:users", ', '.join(prop.lastNames))
+
+    for esaf in bss_data['esafs']:
         start_time = esaf.startDate.astimezone(tzone)
         end_time = esaf.endDate.astimezone(tzone)
         if (start_time < current_time and current_time < end_time and
             end_time-start_time < timedelta(days=50)):
             esaf_badges = [u.badge for u in esaf._users]
             esaf_lnames = [u.lastName for u in esaf._users]
-            # print("Current ESAF ", esaf.esaf_id, esaf.title, esaf.sector, esaf.startDate, esaf_lnames)
-            lname_score = {_x: 0 for _x in curr_props}
-            
-            for pr_prefix, pr_data in curr_props.items():
-                # print(' test ', pr_prefix, pr_data[0], esaf_lnames)
-                for elname in esaf_lnames:
-                    if elname in pr_data[0]:
-                        lname_score[pr_prefix] += 1
-            # print(f'{lname_score=}')
-            best_score, best_pref = 0, None
-            for pref, val in lname_score.items():
-                if val > best_score:
-                    best_score, prefix = val, pref
-           
-            # print("-->> prefix ", prefix, esaf.esaf_id)
-            caput(f"{prefix}esaf:id", "%d" % esaf.esaf_id)
-            caput(f"{prefix}esaf:title",  esaf.title)            
-            caput(f"{prefix}esaf:userBadges",  ', '.join(esaf_badges) )
-            caput(f"{prefix}esaf:users",  ', '.join(esaf_lnames))
-            caput(f"{prefix}esaf:users_total",  len(esaf._users))
-            caput(f"{prefix}esaf:description",  esaf.description)
-            caput(f"{prefix}esaf:startDate", esaf.startDate.isoformat(sep=' ', timespec='seconds'))
-            caput(f"{prefix}esaf:endDate", esaf.endDate.isoformat(sep=' ', timespec='seconds'))            
-    # print(dir(esaf))
-        
+            match = matcher.best(esaf_badges, esaf_lnames)
+            if match is None:
+                print(f"update_pvs: no current proposal matches ESAF {esaf.esaf_id}")
+                continue
+            prefix = match.key
+            put(f"{prefix}esaf:id", "%d" % esaf.esaf_id)
+            put(f"{prefix}esaf:title",  esaf.title)
+            put(f"{prefix}esaf:userBadges",  ', '.join(esaf_badges) )
+            put(f"{prefix}esaf:users",  ', '.join(esaf_lnames))
+            put(f"{prefix}esaf:users_total",  len(esaf._users))
+            put(f"{prefix}esaf:description",  esaf.description)
+            put(f"{prefix}esaf:startDate", esaf.startDate.isoformat(sep=' ', timespec='seconds'))
+            put(f"{prefix}esaf:endDate", esaf.endDate.isoformat(sep=' ', timespec='seconds'))
+
+    counts = pv_writer.flush()
+    print(f"update_pvs: {counts['sent']} PV puts sent, "
+          f"{counts['skipped']} unchanged, {counts['failed']} failed")
+    return counts
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+microbenchmark of parsing ESAF header text: the compiled single-pass
+parser (esafheader.parse_esaf_headers) compared to the line-by-line
+startswith/split parser used before, over a generated corpus of texts
+of ESAF first pages.
+
+   python scripts/bench_esaf_header.py --count 20000
+"""
+import time
+import random
+from argparse import ArgumentParser
+
+from beamtimedb.esafheader import parse_esaf_headers
+
+parser = ArgumentParser(description='benchmark ESAF header parsing')
+parser.add_argument('--count', type=int, default=10000)
+parser.add_argument('--lines', type=int, default=40,
+                    help='lines of other text on each page')
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+WORDS = ('hazard', 'sample', 'beam', 'laser', 'gas', 'cell', 'pressure',
+         'diamond', 'anvil', 'furnace', 'cryostat', 'radioactive')
+
+def make_text(i, rand):
+    btype = rand.choice(('ID', 'BM'))
+    lines = [f'Printed date: 08/01/2026 10:{i%60:02d}:00',
+             f'PEN: 13-{btype}-E-{i%10000:04d} Experiment ID: {260000+i} (GUP)',
+             f'{btype} Start Date: 08/18/2026 08:00:00 {btype} End Date: 08/24/2026 08:00:00',
+             f'Spokesperson: Alex Smith GUP ID: {90000+i%500}']
+    lines.extend(' '.join(rand.choice(WORDS) for _ in range(12))
+                 for _ in range(args.lines))
+    return '\n'.join(lines)
+
+def legacy_parse(page1_text):
+    "line parser used by esafpdf and read_esaf_pdf before esafheader"
+    data =  {'printed_date': None, 'beamline': None, 'pen_line': None,
+             'pen_key': None, 'experiment_id': None, 'proposal_id': None,
+             'start_datetime': None, 'end_datetime': None,
+             'spokesperson': None, 'experiment_type': None}
+    for line in page1_text.split('\n'):
+        if line.startswith('Printed date:'):
+            words = line.split(':')
+            data['printed_date'] = words[1].strip()
+        elif line.startswith('PEN:'):
+            data['pen_line'] = line
+            if 'Experiment ID:' in line:
+                words = [s.strip() for s in line[4:].split('Experiment ID:')]
+                data['pen_key'] = words[0]
+                bwords = words[0].split('-')
+                data['beamline'] = '-'.join(bwords[:2])
+                ewords = words[1].split()
+                data['experiment_id'] = ewords[0].strip()
+                data['experiment_type'] = ewords[1].strip().replace('(','').replace(')','')
+        elif line.startswith('ID Start Date:'):
+            xline = line.replace('ID Start Date:', '')
+            words = xline.split('ID End Date:')
+            data['start_datetime'] = words[0].strip()
+            data['end_datetime'] = words[1].strip()
+        elif line.startswith('BM Start Date:'):
+            xline = line.replace('BM Start Date:', '')
+            words = xline.split('BM End Date:')
+            data['start_datetime'] = words[0].strip()
+            data['end_datetime'] = words[1].strip()
+        elif line.startswith('Spokesperson:'):
+            xline = line.replace('Spokesperson:', '')
+            words = xline.split('GUP ID:')
+            data['spokesperson'] = words[0].strip()
+            data['proposal_id'] = words[1].strip()
+    return data
+
+rand = random.Random(0)
+texts = [make_text(i, rand) for i in range(args.count)]
+print(f"{len(texts)} header texts, {sum(len(t) for t in texts)/len(texts):.0f} characters each")
+
+for label, func in (('line parser', lambda: [legacy_parse(t) for t in texts]),
+                    ('compiled parser', lambda: parse_esaf_headers(texts))):
+    times = []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    print(f"{label:16s} {best:8.3f} s  {best*1.e6/len(texts):8.2f} us per header")
+
+headers = parse_esaf_headers(texts[:3])
+print(headers[0])
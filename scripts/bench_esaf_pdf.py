@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+benchmark reading ESAF PDF headers, per file, with full text extraction
+of the first page and with the fast header reader (see esafpdf.read_esaf_header)
+
+   python scripts/bench_esaf_pdf.py /path/to/ESAFs/2025-1 [--repeat 3]
+
+all *.pdf files below the folder are read.  Reports time per file for
+each method, how many files the fast reader had to fall back to full
+extraction for, and any files for which the two methods disagree.
+"""
+import time
+import statistics
+from pathlib import Path
+from argparse import ArgumentParser
+
+from beamtimedb.esafpdf import (read_esaf_header, read_page1_content,
+                                iter_content_lines)
+from beamtimedb.esafheader import parse_esaf_header_text, REQUIRED_FIELDS
+
+parser = ArgumentParser(description='benchmark reading ESAF PDF headers')
+parser.add_argument('folder', help='folder of ESAF PDFs (searched recursively)')
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+files = sorted(Path(args.folder).rglob('*.pdf'))
+print(f"{len(files)} PDF files")
+
+def best_time(func, fname):
+    out, times = None, []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        try:
+            out = func(fname)
+        except Exception:
+            out = None
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+def needs_fallback(fname):
+    try:
+        header = parse_esaf_header_text(iter_content_lines(read_page1_content(fname)))
+    except Exception:
+        return True
+    return len(header.missing(REQUIRED_FIELDS)) > 0
+
+full_times, fast_times, fallbacks, differ = [], [], 0, []
+for fname in files:
+    tfull, full = best_time(lambda f: read_esaf_header(f, fast=False), fname)
+    tfast, fast = best_time(lambda f: read_esaf_header(f, fast=True), fname)
+    full_times.append(tfull)
+    fast_times.append(tfast)
+    if needs_fallback(fname):
+        fallbacks += 1
+    if full is not None and fast is not None:
+        if full != fast:
+            differ.append(fname)
+
+for label, times in (('full extraction', full_times), ('fast header', fast_times)):
+    if len(times) > 0:
+        print(f"{label:16s} mean {statistics.mean(times)*1000:8.2f} ms  "
+              f"median {statistics.median(times)*1000:8.2f} ms  "
+              f"total {sum(times):8.3f} s")
+print(f"fast header fell back to full extraction for {fallbacks} files")
+for fname in differ:
+    print(f"  header values differ: {fname}")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+benchmark matching ESAFs to proposals by their users with ProposalMatcher,
+compared to scanning the list of last names of every proposal for every
+ESAF user, using generated data from FakeBSSServer.
+
+   python scripts/bench_matcher.py --esafs 2000 --proposals 50
+"""
+import time
+from argparse import ArgumentParser
+
+from beamtimedb import ProposalMatcher
+from beamtimedb.fakebss import FakeBSSServer
+
+parser = ArgumentParser(description='benchmark ESAF to proposal matching')
+parser.add_argument('--esafs', type=int, default=1000)
+parser.add_argument('--proposals', type=int, default=50)
+parser.add_argument('--users', type=int, default=2000)
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+bss = FakeBSSServer(n_esafs=args.esafs, n_proposals=args.proposals,
+                    n_users=args.users)
+run = bss.current_run
+esafs = bss.esafs('13', run=run)
+proposals = {}
+for beamline in ('13-ID-E', '13-ID-C,D', '13-BM-D', '13-BM-C'):
+    proposals.update(bss.proposals(beamline, run=run))
+print(f"{len(esafs)} ESAFs, {len(proposals)} proposals")
+
+def scan_lastnames():
+    "match as update_pvs did: last names in list, for each proposal"
+    out = {}
+    for esaf in esafs:
+        best_score, best_key = 0, None
+        for key, prop in proposals.items():
+            lnames = prop.lastNames
+            score = sum(1 for u in esaf._users if u.lastName in lnames)
+            if score > best_score:
+                best_score, best_key = score, key
+        out[esaf.esaf_id] = best_key
+    return out
+
+def use_matcher():
+    out = {}
+    matcher = ProposalMatcher()
+    for key, prop in proposals.items():
+        matcher.add(key, prop.badges, prop.lastNames)
+    for esaf in esafs:
+        match = matcher.best([u.badge for u in esaf._users],
+                             [u.lastName for u in esaf._users])
+        out[esaf.esaf_id] = None if match is None else match.key
+    return out
+
+for label, func in (('scan last names', scan_lastnames),
+                    ('ProposalMatcher', use_matcher)):
+    times = []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    nmatched = sum(1 for v in result.values() if v is not None)
+    print(f"{label:18s} best {min(times)*1000:9.2f} ms  "
+          f"{nmatched} of {len(result)} ESAFs matched")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+benchmark BeamtimeDB startup time, comparing full schema reflection,
+selective reflection, and cold and warm starts with the schema cache.
+
+By default, a throwaway SQLite database is created.  Use --live to
+use the database from the BEAMTIMEDB_CREDENTIALS file.
+
+   python scripts/bench_startup.py --repeat 20
+"""
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from argparse import ArgumentParser
+
+from beamtimedb import BeamtimeDB, create_beamtimedb
+
+
+def timeit(label, func, repeat=10):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    print(f"{label:32s}  best {1000*times[0]:8.2f} ms   "
+          f"median {1000*times[len(times)//2]:8.2f} ms")
+    return times
+
+
+def main():
+    parser = ArgumentParser(description='benchmark BeamtimeDB startup')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--live', action='store_true',
+                        help='use database from BEAMTIMEDB_CREDENTIALS')
+    args = parser.parse_args()
+
+    tmpdir = Path(tempfile.mkdtemp(prefix='bench_startup_'))
+    dbkws = {}
+    if not args.live:
+        dbfile = Path(tmpdir, 'beamtime.db').as_posix()
+        create_beamtimedb(dbfile, server='sqlite')
+        dbkws = {'dbname': dbfile, 'server': 'sqlite'}
+
+    def full(i):
+        BeamtimeDB(**dbkws).get_info('version')
+
+    def selective(i):
+        BeamtimeDB(tables=['info'], **dbkws).get_info('version')
+
+    def cold_cache(i):
+        cache = Path(tmpdir, f'cold_{i}')
+        BeamtimeDB(schema_cache=cache, **dbkws).get_info('version')
+
+    warm = Path(tmpdir, 'warm')
+    BeamtimeDB(schema_cache=warm, **dbkws)
+
+    def warm_cache(i):
+        BeamtimeDB(schema_cache=warm, **dbkws).get_info('version')
+
+    try:
+        timeit('full reflection', full, args.repeat)
+        timeit("selective (tables=['info'])", selective, args.repeat)
+        timeit('schema cache, cold', cold_cache, args.repeat)
+        timeit('schema cache, warm', warm_cache, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+benchmark a full-run APS BSS sync (filldb_from_apsbss) against a
+throwaway database, using the in-process FakeBSSServer.
+
+Reports wall time, SQL statements, and rows written, in total and per
+ESAF, for a first (full) sync and for a repeated sync of unchanged data.
+
+   python scripts/bench_sync.py --esafs 200 --users 800
+   python scripts/bench_sync.py --incremental --latency 0.2
+   python scripts/bench_sync.py --server postgresql --host dbhost --user me --password xx
+"""
+import io
+import os
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+
+from beamtimedb import BeamtimeDB, create_beamtimedb, filldb_from_apsbss
+from beamtimedb.fakebss import FakeBSSServer
+
+
+def run_sync(label, bt_db, bss, nesafs, verbose=False, **kws):
+    out = io.StringIO()
+    t0 = time.perf_counter()
+    with bt_db.capture_stats() as stats:
+        if verbose:
+            result = filldb_from_apsbss(bt_db=bt_db, bss_server=bss, **kws)
+        else:
+            with redirect_stdout(out):
+                result = filldb_from_apsbss(bt_db=bt_db, bss_server=bss, **kws)
+    dt = time.perf_counter() - t0
+    nesafs = max(1, nesafs)
+    print(f"{label:20s} {dt:8.3f} s  {stats.statements:7d} statements "
+          f"({stats.statements/nesafs:6.2f}/ESAF)  {stats.rows_written:7d} rows "
+          f"written ({stats.rows_written/nesafs:6.2f}/ESAF)")
+    return result
+
+
+def main():
+    parser = ArgumentParser(description='benchmark filldb_from_apsbss')
+    parser.add_argument('--esafs', type=int, default=200)
+    parser.add_argument('--proposals', type=int, default=20,
+                        help='proposals per beamline')
+    parser.add_argument('--users', type=int, default=800)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each BSS request')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--server', default='sqlite')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default=5432)
+    parser.add_argument('--user', default='')
+    parser.add_argument('--password', default='')
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.server.startswith('sqlit'):
+        tmpdir = Path(tempfile.mkdtemp(prefix='bench_sync_'))
+        dbname = Path(tmpdir, 'beamtime.db').as_posix()
+        conn = {'server': 'sqlite'}
+    else:
+        dbname = f'beamtime_bench_{os.getpid()}'
+        conn = {'server': args.server, 'host': args.host, 'port': args.port,
+                'user': args.user, 'password': args.password}
+
+    with redirect_stdout(io.StringIO()):
+        create_beamtimedb(dbname, **conn)
+    bt_db = BeamtimeDB(dbname, **conn)
+    try:
+        bss = FakeBSSServer(n_esafs=args.esafs, n_proposals=args.proposals,
+                            n_users=args.users, latency=args.latency)
+        print(f"sync of {args.esafs} ESAFs, {4*args.proposals} proposals, "
+              f"{args.users} users into {args.server}, incremental={args.incremental}")
+        kws = {'incremental': args.incremental, 'verbose': args.verbose}
+        run_sync('full sync', bt_db, bss, args.esafs, **kws)
+        run_sync('repeat sync', bt_db, bss, args.esafs, **kws)
+        print(f"BSS requests: {bss.requests}")
+    finally:
+        bt_db.engine.dispose()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        else:
+            from sqlalchemy_utils import drop_database
+            drop_database(bt_db.engine.url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+read ESAF PDFs for a run from the esaf_pdf_folder into the beamtime database
+
+   python scripts/read_esaf_pdfs.py [--run 2025-1] [--workers 4] [--force]
+
+only PDFs that are new or changed since the last scan are read,
+unless --force is given.
+
+with --watch, keep watching the run's beamline folders and read each
+new or changed PDF once it is completely written (see beamtimedb.esafwatch).
+"""
+from argparse import ArgumentParser
+
+from beamtimedb import read_esaf_pdfs
+from beamtimedb.esafwatch import ESAFWatcher, SETTLE_TIME, POLL_INTERVAL
+
+parser = ArgumentParser(description='read ESAF PDFs into beamtime database')
+parser.add_argument('--run', default=None, help='run name [current run]')
+parser.add_argument('--workers', type=int, default=None,
+                    help='number of processes reading PDFs (0: one per CPU)')
+parser.add_argument('--force', action='store_true',
+                    help='read all PDFs, not only new or changed ones')
+parser.add_argument('--folder', default=None,
+                    help='top folder of ESAF PDFs [info esaf_pdf_folder]')
+parser.add_argument('--watch', action='store_true',
+                    help='watch folders for new or changed PDFs')
+parser.add_argument('--settle', type=float, default=SETTLE_TIME,
+                    help='seconds a PDF must be unchanged before it is read')
+parser.add_argument('--poll', type=float, default=POLL_INTERVAL,
+                    help='seconds between folder scans')
+parser.add_argument('--no-inotify', action='store_true',
+                    help='only scan folders, even if inotify is available')
+args = parser.parse_args()
+
+if args.watch:
+    watcher = ESAFWatcher(run=args.run, esaf_folder=args.folder,
+                          settle_time=args.settle, poll_interval=args.poll,
+                          use_inotify=not args.no_inotify)
+    watcher.run()
+    raise SystemExit
+
+result = read_esaf_pdfs(run=args.run, workers=args.workers, force=args.force,
+                        esaf_folder=args.folder)
+for key, val in result.items():
+    print(f"  {key:22s} {val}")
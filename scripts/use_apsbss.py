@@ -1,75 +1,68 @@
-from apsbss.server_interface import Server as BSS_Server
-from beamtimedb import BeamtimeDB
+#!/usr/bin/env python
+"""
+fill the beamtime database from the APS BSS for sector 13
 
-bt_db = BeamtimeDB()
+   python scripts/use_apsbss.py [--run 2025-1] [--incremental]
 
-bss = BSS_Server()
-sector = '13'
-beamlines = {'13IDE:bss:': '13-ID-E',
-             '13IDCD:bss:': '13-ID-C,D',
-             '13BMD:bss:': '13-BM-D',
-             '13BMC:bss:': '13-BM-C'
-             }
+use --fake to sync generated data from FakeBSSServer instead of
+the APS BSS, for testing.
 
+use --cache to save APS BSS responses to the on-disk cache (see
+beamtimedb.bsscache), and --offline to sync only from that cache:
 
-for esaf in bss.current_esafs(sector):
-    # print(dir(esaf))
-    print(esaf.esaf_id, esaf.run, esaf.status,
-          esaf.startDate,  esaf.endDate,  esaf.title)
-    user_ids = []
-    spokesperson = None
-    for user in esaf._users:
-        d_user = bt_db.get_user(badge=user.badge)
-        if d_user is None:
-            print("Adding User ", user)
-            d_user = bt_db.add_user(badge=int(user.badge), last_name=user.lastName,
-                                    first_name=user.firstName, email=user.email)
-        user_ids.append(d_user.id)
-        # print(user, user.institution_id)
-        if user.is_pi:
-            spokesperson = d_user.id
-            
-    # print("USER IDS ", user_ids, spokesperson)
-    dexp = bt_db.get_experiment(esaf.esaf_id)
-    if dexp is None:
-        bt_db.add_experiment(esaf.esaf_id, run=esaf.run, esaf_status=esaf.status,
-                             start_date=esaf.startDate, end_date=esaf.endDate,
-                             title=esaf.title, description=esaf.description,
-                             spokesperson=spokesperson, users=user_ids)
+   python scripts/use_apsbss.py --run 2024-2 --cache
+   python scripts/use_apsbss.py --run 2024-2 --offline
+"""
+from argparse import ArgumentParser
 
-        
-# proposals
-print("################################")
-for prefix, beamline in beamlines.items():
-    print(beamline)
-    for propid, prop in bss.current_proposals(beamline).items():
-        print(propid, beamline, prop)
-        print(dir(prop))
-   
-        print(propid, prop.proposal_id, prop.run, prop.startDate, prop.endDate, prop.badges)
-        spokesperson = None
-        for user in prop.to_dict()['experimenters']:
-            badge = int(user['badge'])
-            affil = user['institution']
-            inst = bt_db.get_institution(name=affil)
-            if inst is None:
-                inst = bt_db.add_institution(affil)
+from beamtimedb import BeamtimeDB, filldb_from_apsbss
+from beamtimedb.use_apsbss import connect_bss
+from beamtimedb.bsscache import CachedBSSServer
 
-            b_user = bt_db.get_user(badge=badge)
-            if b_user is None:
-                print("Adding User ", user)
-                b_user = bt_db.add_user(user['firstName'], user['lastName'], user['email'], badge)
+parser = ArgumentParser(description='fill beamtime database from APS BSS')
+parser.add_argument('--sector', default='13')
+parser.add_argument('--run', default=None, help='run name [current run]')
+parser.add_argument('--incremental', action='store_true',
+                    help='update only changed ESAFs and proposals')
+parser.add_argument('--fake', action='store_true',
+                    help='use generated data from FakeBSSServer')
+parser.add_argument('--cache', action='store_true',
+                    help='use and save on-disk cache of APS BSS responses')
+parser.add_argument('--offline', action='store_true',
+                    help='use only on-disk cache of APS BSS responses')
+parser.add_argument('--cache-folder', default=None,
+                    help='folder for APS BSS response cache')
+parser.add_argument('--stats', action='store_true',
+                    help='print SQL statement statistics')
+args = parser.parse_args()
 
-            bt_db.update('person', where={'badge': badge}, affiliation_id=inst.id)
-            if user['piFlag'] in (True, 'Y', 'y'):
-                spokesperson = b_user.id
+bss = None
+if args.fake:
+    from beamtimedb.fakebss import FakeBSSServer
+    bss = FakeBSSServer(sector=args.sector)
 
-        title = prop.title
-        if title.endswith('\n'): title = title[:-1]
-        kws = {'title': title}
-        if spokesperson is not None:
-            kws['spokesperson_id'] = spokesperson
-        b_prop = bt_db.get_proposal(propid)
-        if b_prop is None:
-            b_prop = bt_db.add_proposal(propid, **kws)
-                
+bt_db = BeamtimeDB(instrument=args.stats)
+if args.offline:
+    bss = CachedBSSServer(None, folder=args.cache_folder, offline=True)
+elif args.cache:
+    if bss is None:
+        bss = connect_bss(bt_db)
+    bss = CachedBSSServer(bss, folder=args.cache_folder)
+result = filldb_from_apsbss(sector=args.sector, run=args.run,
+                            bt_db=bt_db, bss_server=bss,
+                            incremental=args.incremental)
+for key, val in result.items():
+    print(f"  {key:22s} {val}")
+
+if args.stats:
+    stats = bt_db.stats()
+    print(f"SQL: {stats['statements']} statements, {stats['rows']} rows, "
+          f"{stats['time']:.3f} sec")
+    for name, mstats in sorted(stats['methods'].items(),
+                               key=lambda x: -x[1]['time']):
+        print(f"  {name:22s} {mstats['statements']:6d} statements "
+              f"{mstats['time']:8.3f} sec (max {mstats['max_time']:.4f})")
+    print("slowest statements:")
+    for slow in stats['slowest'][:5]:
+        print(f"  {slow['time']:.4f} sec {slow['method']}: "
+              f"{slow['statement'][:100]}")